@@ -0,0 +1,279 @@
+#!/usr/bin/env python3.7
+
+"""
+Measure how generate_header.py and generate_drivers.py scale.
+
+Every scaling point generates a synthetic object model or DUH document (see
+synthetic.py), runs the generator on it in a fresh process, and records the
+wall time, the peak RSS of the process and the size of the generated files.
+Results are written as JSON, and can be compared against a stored baseline:
+
+    run_benchmarks.py --output results.json
+    run_benchmarks.py --output new.json --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+
+import synthetic
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+
+# Every scaling point varies one parameter of the base point.
+BASE_POINT = {
+    'devices': 4,
+    'instances': 4,
+    'register_fields': 64,
+    'interrupts': 2,
+    'ref_depth': 1,
+}
+SCALES = {
+    'devices': [1, 4, 16, 64],
+    'instances': [1, 4, 16, 64],
+    'register_fields': [16, 64, 256, 1024, 4096],
+    'interrupts': [0, 2, 8, 32],
+    'ref_depth': [0, 1, 2, 4],
+}
+QUICK_SCALES = {name: values[:2] for name, values in SCALES.items()}
+
+# Parameters each generator depends on. Scaling points varying anything
+# else are skipped for that generator.
+BENCHMARK_PARAMETERS = {
+    'generate_header': ('devices', 'instances', 'register_fields', 'interrupts'),
+    'generate_drivers': ('register_fields', 'ref_depth'),
+}
+
+
+def scaling_points(scales: t.Dict[str, t.List[int]],
+                   benchmark: str) -> t.List[t.Dict[str, int]]:
+    """
+    :return: the distinct parameter sets to run a benchmark with
+    """
+    points = []
+    for name in BENCHMARK_PARAMETERS[benchmark]:
+        for value in scales[name]:
+            point = {p: BASE_POINT[p] for p in BENCHMARK_PARAMETERS[benchmark]}
+            point[name] = value
+            if point not in points:
+                points.append(point)
+    return points
+
+
+def measure(cmd: t.List[str]) -> t.Tuple[float, int]:
+    """
+    Run a command to completion.
+
+    :return: the wall time in seconds and the peak RSS in kilobytes
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    # Reap the process ourselves, as wait4 is the only way to get the
+    # resource usage of this one child.
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    if os.WIFEXITED(status):
+        process.returncode = os.WEXITSTATUS(status)
+    else:
+        process.returncode = -os.WTERMSIG(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return wall_time, rusage.ru_maxrss
+
+
+def output_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def run_point(benchmark: str, point: t.Dict[str, int], work_dir: Path,
+              python: str, repeat: int) -> dict:
+    """
+    Run one benchmark at one scaling point.
+
+    :return: the result record of the scaling point
+    """
+    work_dir.mkdir(parents=True)
+    out_dir = work_dir / 'out'
+
+    if benchmark == 'generate_header':
+        om_path = work_dir / 'object_model.json'
+        om_path.write_text(json.dumps(synthetic.make_object_model(
+            point['devices'], point['instances'], point['register_fields'],
+            point['interrupts'])))
+        cmd = [python, str(SCRIPTS_DIR / 'generate_header.py'),
+               '--object-model', str(om_path),
+               '--vendor', 'sifive',
+               '--bsp-dir', str(out_dir),
+               '--overwrite-existing',
+               '--no-cache']
+        for device in synthetic.device_names(point['devices']):
+            cmd += ['--device', device]
+    else:
+        duh_path = synthetic.write_duh_documents(
+            work_dir / 'duh', 'dev0', point['register_fields'],
+            point['ref_depth'])
+        cmd = [python, str(SCRIPTS_DIR / 'generate_drivers.py'),
+               '--duh-document', str(duh_path),
+               '--vendor', 'sifive',
+               '--device', 'dev0',
+               '--metal-dir', str(out_dir),
+               '--overwrite-existing']
+
+    wall_times = []
+    peak_rss = 0
+    for _ in range(repeat):
+        wall_time, rss = measure(cmd)
+        wall_times.append(wall_time)
+        peak_rss = max(peak_rss, rss)
+
+    return {
+        'benchmark': benchmark,
+        'params': point,
+        'wall_time_s': min(wall_times),
+        'peak_rss_kb': peak_rss,
+        'output_bytes': output_size(out_dir),
+    }
+
+
+def _result_key(result: dict) -> str:
+    return json.dumps([result['benchmark'], result['params']], sort_keys=True)
+
+
+def compare(results: t.List[dict], baseline: t.List[dict],
+            tolerance: float) -> t.List[str]:
+    """
+    Compare results against a baseline.
+
+    :param tolerance: the allowed relative increase of the wall time and
+        peak RSS, e.g. 0.1 for 10%
+    :return: a description of every regression
+    """
+    baseline_by_key = {_result_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_by_key.get(_result_key(result))
+        if old is None:
+            continue
+        for metric in ('wall_time_s', 'peak_rss_kb', 'output_bytes'):
+            new_value, old_value = result[metric], old[metric]
+            if metric == 'output_bytes':
+                # The generated files should not change size at all.
+                regressed = new_value != old_value
+            else:
+                regressed = new_value > old_value * (1 + tolerance)
+            if regressed:
+                regressions.append(
+                    f"{result['benchmark']} {json.dumps(result['params'])}: "
+                    f"{metric} {old_value} -> {new_value}")
+            ratio = new_value / old_value if old_value else float('inf')
+            print(f"{result['benchmark']:16} {json.dumps(result['params'])} "
+                  f"{metric:12} {old_value:>12.6g} -> {new_value:>12.6g} "
+                  f"({ratio:.2f}x){' REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def handle_args(argv: t.Optional[t.List[str]] = None):
+    """
+    :param argv: the command line arguments, defaulting to sys.argv[1:]
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="The path to write the results to",
+        type=Path,
+        required=True,
+    )
+
+    parser.add_argument(
+        "--baseline",
+        help="The path to the results of a previous run to compare against",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        help="The relative increase of wall time or peak RSS over the "
+             "baseline reported as a regression (default: %(default)s)",
+        type=float,
+        default=0.1,
+    )
+
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        help="The generator to benchmark. May be repeated. Defaults to all.",
+        choices=sorted(BENCHMARK_PARAMETERS),
+        action="append",
+    )
+
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        default=False,
+        help="Only run the two smallest values of each parameter",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="The number of runs of each scaling point. The fastest is "
+             "reported (default: %(default)s)",
+        type=int,
+        default=3,
+    )
+
+    parser.add_argument(
+        "--python",
+        help="The interpreter to run the generators with "
+             "(default: %(default)s)",
+        default=sys.executable,
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    args = handle_args(argv)
+    scales = QUICK_SCALES if args.quick else SCALES
+    benchmarks = args.benchmark or sorted(BENCHMARK_PARAMETERS)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for benchmark in benchmarks:
+            for i, point in enumerate(scaling_points(scales, benchmark)):
+                result = run_point(benchmark, point,
+                                   Path(tmp_dir) / f'{benchmark}{i}',
+                                   args.python, args.repeat)
+                print(f"{benchmark:16} {json.dumps(point)} "
+                      f"{result['wall_time_s']:.3f}s "
+                      f"{result['peak_rss_kb']}KB "
+                      f"{result['output_bytes']}B", file=sys.stderr)
+                results.append(result)
+
+    args.output.write_text(json.dumps({
+        'python': platform.python_version(),
+        'results': results,
+    }, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('\n'.join(['Regressions:'] + regressions), file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
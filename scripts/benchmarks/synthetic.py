@@ -0,0 +1,227 @@
+#!/usr/bin/env python3.7
+
+"""
+Generators for synthetic object models and DUH documents, used to measure
+how generate_header.py and generate_drivers.py scale.
+"""
+
+import argparse
+import json
+import sys
+import typing as t
+from pathlib import Path
+
+# Register fields are packed FIELDS_PER_REGISTER to a 32-bit register.
+FIELDS_PER_REGISTER = 4
+FIELD_WIDTH = 32 // FIELDS_PER_REGISTER
+
+
+def _om_register_field(device: str, index: int) -> dict:
+    register = index // FIELDS_PER_REGISTER
+    return {
+        "bitRange": {
+            "base": index * FIELD_WIDTH,
+            "size": FIELD_WIDTH,
+            "_types": ["OMBitRange", "OMCompoundType"],
+        },
+        "description": {
+            "name": f"field{index % FIELDS_PER_REGISTER}",
+            "description": f"Field {index} of {device}",
+            "group": f"reg{register}",
+            "access": {"_types": ["RW", "OMRegFieldAccessType", "OMEnum"]},
+            "volatile": False,
+            "resetValue": 0,
+            "enumerations": [],
+            "_types": ["OMRegFieldDesc", "OMCompoundType"],
+        },
+        "_types": ["OMRegField", "OMCompoundType"],
+    }
+
+
+def _om_device(device: str, instance: int, base_address: int,
+               register_fields: int, first_interrupt: int,
+               interrupts: int) -> dict:
+    name = f"{device}@{base_address:x}"
+    return {
+        "memoryRegions": [{
+            "name": name,
+            "description": "control",
+            "addressSets": [{
+                "base": base_address,
+                "mask": 0xfff,
+                "_types": ["OMAddressSet", "OMCompoundType"],
+            }],
+            "permissions": {
+                "readable": True,
+                "writeable": True,
+                "executable": False,
+                "cacheable": False,
+                "atomics": False,
+                "_types": ["OMPermissions", "OMCompoundType"],
+            },
+            "registerMap": {
+                "registerFields": [_om_register_field(device, i)
+                                   for i in range(register_fields)],
+                "groups": [],
+                "_types": ["OMRegisterMap", "OMCompoundType"],
+            },
+            "_types": ["OMMemoryRegion", "OMCompoundType"],
+        }],
+        "interrupts": [{
+            "receiver": "interrupt-controller@c000000",
+            "numberAtReceiver": first_interrupt + i,
+            "name": name,
+            "_types": ["OMInterrupt", "OMCompoundType"],
+        } for i in range(interrupts)],
+        "specifications": [],
+        "rtlModule": {
+            "moduleName": f"{device}_{instance}",
+            "interface": {
+                "clocks": [],
+                "clockRelationships": [],
+                "resets": [],
+                "_types": ["OMRTLInterface"],
+            },
+            "_types": ["OMRTLModule", "OMRTLComponent"],
+        },
+        "_types": [f"OM{device}", "OMDevice", "OMComponent", "OMCompoundType"],
+    }
+
+
+def device_names(devices: int) -> t.List[str]:
+    """:return: the names of the devices in a synthetic object model"""
+    return [f"dev{i}" for i in range(devices)]
+
+
+def make_object_model(devices: int, instances: int, register_fields: int,
+                      interrupts: int) -> list:
+    """
+    Build a synthetic object model.
+
+    :param devices: the number of device types
+    :param instances: the number of instances of each device type
+    :param register_fields: the number of register fields of each device
+    :param interrupts: the number of interrupts of each instance
+    :return: the object model
+    """
+    components = []
+    next_interrupt = 1
+    for d, device in enumerate(device_names(devices)):
+        for instance in range(instances):
+            base_address = 0x10000000 + (d * instances + instance) * 0x1000
+            components.append(_om_device(device, instance, base_address,
+                                         register_fields, next_interrupt,
+                                         interrupts))
+            next_interrupt += interrupts
+    return [{
+        "components": components,
+        "_types": ["OMCore", "OMDevice", "OMComponent", "OMCompoundType"],
+    }]
+
+
+def _duh_register(index: int, fields: int) -> dict:
+    return {
+        "name": f"reg{index}",
+        "addressOffset": index * 4,
+        "size": 32,
+        "access": "read-write",
+        "fields": [{
+            "name": f"field{i}",
+            "bitOffset": i * FIELD_WIDTH,
+            "bitWidth": FIELD_WIDTH,
+        } for i in range(fields)],
+    }
+
+
+def write_duh_documents(out_dir: Path, device: str, register_fields: int,
+                        ref_depth: int) -> Path:
+    """
+    Write a synthetic DUH document describing one device.
+
+    Each register of the document is reached through a chain of ref_depth
+    $refs, one per file, so that a depth of 0 gives a self-contained
+    document.
+
+    :param out_dir: the directory to write the documents to
+    :param device: the name of the device
+    :param register_fields: the number of register fields of the device
+    :param ref_depth: the number of $refs leading to each register
+    :return: the path of the top-level document
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    registers = [
+        _duh_register(i, min(FIELDS_PER_REGISTER,
+                             register_fields - i * FIELDS_PER_REGISTER))
+        for i in range(-(-register_fields // FIELDS_PER_REGISTER))
+    ]
+
+    names = [register["name"] for register in registers]
+
+    # Write the chain from the innermost file outwards.
+    for depth in range(ref_depth, 0, -1):
+        file_name = f"{device}.registers{depth}.json5"
+        (out_dir / file_name).write_text(json.dumps(
+            dict(zip(names, registers)),
+            indent=2,
+        ))
+        registers = [{"$ref": f"{file_name}#/{name}"} for name in names]
+
+    document = {
+        "component": {
+            "vendor": "sifive",
+            "name": device,
+            "memoryMaps": [{
+                "name": "csr",
+                "addressBlocks": [{
+                    "name": "csr",
+                    "baseAddress": 0,
+                    "range": 0x1000,
+                    "width": 32,
+                    "registers": registers,
+                }],
+            }],
+        },
+    }
+    path = out_dir / f"{device}.json5"
+    path.write_text(json.dumps(document, indent=2))
+    return path
+
+
+def handle_args(argv: t.Optional[t.List[str]] = None):
+    """
+    :param argv: the command line arguments, defaulting to sys.argv[1:]
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-o",
+        "--out-dir",
+        help="The directory to write the object model and DUH document to",
+        type=Path,
+        required=True,
+    )
+
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--instances", type=int, default=4)
+    parser.add_argument("--register-fields", type=int, default=64)
+    parser.add_argument("--interrupts", type=int, default=2)
+    parser.add_argument("--ref-depth", type=int, default=1)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    args = handle_args(argv)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    object_model = make_object_model(args.devices, args.instances,
+                                     args.register_fields, args.interrupts)
+    (args.out_dir / "object_model.json").write_text(
+        json.dumps(object_model, indent=2))
+    write_duh_documents(args.out_dir / "duh", "dev0", args.register_fields,
+                        args.ref_depth)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
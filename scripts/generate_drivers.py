@@ -1,16 +1,25 @@
 #!/usr/bin/env python3.7
 
 import argparse
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
+import os
 import string
 import sys
+import tempfile
 import textwrap
 import typing as t
 from dataclasses import dataclass
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import unquote, urldefrag, urljoin, urlparse
 
-import json5
-import jsonref
+import incremental
+import profiling
+import streaming
 
 PlainJSONType = t.Union[dict, list, t.AnyStr, float, bool]
 JSONType = t.Union[PlainJSONType, t.Iterator[PlainJSONType]]
@@ -55,6 +64,12 @@ class Register:
     width: int  # in bits
     fields: t.List[RegisterField]
     address_block: AddressBlock
+    access: str = 'read-write'  # the IP-XACT access type, e.g. write-only
+    reset_value: int = 0
+
+    @property
+    def readable(self) -> bool:
+        return self.access not in ('write-only', 'writeOnce')
 
     @classmethod
     def make_register(
@@ -64,107 +79,587 @@ class Register:
         width: int,
         fields: t.List[RegisterField],
         address_block: AddressBlock,
+        access: str = 'read-write',
+        reset_value: int = 0,
     ) -> "Register":
         if width not in (8, 16, 32, 64):
             raise Exception(f'Invalid register width {width}, for register '
                             f'{name}.\n'
                             f'Width should be not 8, 16, 32, or 64.\n'
                             f'Please fix the register width in DUH document.')
-        return cls(name, offset, width, fields, address_block)
+        return cls(name, offset, width, fields, address_block, access,
+                   reset_value)
 
 
 ###
 # templates
 ###
-def generate_vtable_declarations(device_name: str,
-                                 reg_list: t.List[Register],
-                                 include_address_block: bool) -> str:
+
+@dataclass(frozen=True)
+class RegisterAccessor:
     """
-    Generate the vtable entries for a device and set of registers. This
-    creates the declarations for function pointers for all the driver functions.
-    This is used to provide a single point for all functions that can be used
-    for multiple devices.
-    :param device_name: the name of the device
-    :param reg_list: a list of Register objects for the device
-    :param include_address_block: If True, include the address block name in
-        the generated C function prototypes.
-    :return: the c code for the vtable entries
+    The names and layout of one register, for the functions reading or
+    writing the whole register and the accessors of its fields.
     """
+    func_name: str  # e.g. uart_txctrl, the prefix of every function name
+    name: str  # e.g. txctrl, the name of the register in the shadow struct
+    offset: int  # the offset of the register from the device base, in bytes
+    size: int  # the width of the register, in bits
+    readable: bool  # False if reading the register does not return its value
+    shadowed: bool  # True if the driver keeps a copy of the register in RAM
+    reset_value: int
+
+
+@dataclass(frozen=True)
+class FieldAccessor:
+    """
+    The names and width of the accessor functions of one register field.
+
+    These are computed once per field and shared by every emitter, rather
+    than rebuilt from the register and field names by each of them.
+    """
+    func_name: str  # e.g. uart_txdata_data, the suffix of every function name
+    register: RegisterAccessor  # the register containing the field
+    shift: int  # the offset of the field within the register, in bits
+    mask: int  # the mask of the field within the register
+
+    @property
+    def size(self) -> int:
+        return self.register.size
 
-    rv = []
+    @property
+    def offset(self) -> int:
+        return self.register.offset
+
+    @property
+    def width(self) -> int:
+        return (self.mask >> self.shift).bit_length()
+
+
+def is_shadowed(register: Register, shadow_write_only: bool,
+                shadow_registers: t.Collection[str]) -> bool:
+    """
+    :param register: a register of the device
+    :param shadow_write_only: If True, shadow the registers which cannot be
+        read back
+    :param shadow_registers: the names of other registers to shadow, either
+        plain or qualified by their address block, e.g. ctrl or csr.ctrl
+    :return: True if the driver should keep a shadow copy of the register
+    """
+    if shadow_write_only and not register.readable:
+        return True
+    return register.name in shadow_registers or \
+        f'{register.address_block.name}.{register.name}' in shadow_registers
+
+
+def make_field_accessors(device: str,
+                         reg_list: t.List[Register],
+                         include_address_block: bool,
+                         shadow_write_only: bool = False,
+                         shadow_registers: t.Collection[str] = ()) \
+        -> t.List[FieldAccessor]:
+    """
+    Build the accessors of every field of a device.
+
+    :param device: the name of the device
+    :param reg_list: the list of registers for the device
+    :param include_address_block: If True, include the address block name in
+        the generated C macros and function names.
+    :param shadow_write_only: If True, shadow the write-only registers
+    :param shadow_registers: the names of other registers to shadow
+    :return: the accessors, in the order of the registers and fields
+    :raise Exception: if a register to shadow is not a register of the
+        device
+    """
+    rv: t.List[FieldAccessor] = []
 
     for a_reg in reg_list:
-        address_block_name = a_reg.address_block.name.lower()
+        if include_address_block:
+            name = f'{a_reg.address_block.name.lower()}_{a_reg.name.lower()}'
+        else:
+            name = a_reg.name.lower()
+        register = RegisterAccessor(
+            func_name=f'{device}_{name}',
+            name=name,
+            offset=a_reg.address_block.baseAddress + a_reg.offset,
+            size=a_reg.width,
+            readable=a_reg.readable,
+            shadowed=is_shadowed(a_reg, shadow_write_only, shadow_registers),
+            reset_value=a_reg.reset_value,
+        )
+        register_mask = (1 << a_reg.width) - 1
         for field in a_reg.fields:
-            reg_name = a_reg.name.lower()
-            field_name = field.name.lower()
-            size = a_reg.width
+            rv.append(FieldAccessor(
+                func_name=f'{register.func_name}_{field.name.lower()}',
+                register=register,
+                shift=field.bit_offset,
+                mask=(((1 << field.bit_width) - 1) << field.bit_offset) & register_mask,
+            ))
+
+    register_names = {name for a_reg in reg_list
+                      for name in (a_reg.name,
+                                   f'{a_reg.address_block.name}.{a_reg.name}')}
+    unknown = [name for name in dict.fromkeys(shadow_registers)
+               if name not in register_names]
+    if unknown:
+        raise Exception(f"Registers to shadow not found in {device}: "
+                        f"{', '.join(unknown)}")
+
+    return rv
+
+
+def make_register_accessors(accessors: t.List[FieldAccessor]) \
+        -> t.List[RegisterAccessor]:
+    """
+    :param accessors: the accessors of the fields of the device
+    :return: the accessors of every register with fields, in order
+    """
+    return list(dict.fromkeys(accessor.register for accessor in accessors))
 
-            if include_address_block:
-                func_name_prefix = f'v_{device_name}_{address_block_name}_{reg_name}_{field_name}'
-            else:
-                func_name_prefix = f'v_{device_name}_{reg_name}_{field_name}'
 
-            write_func = f'    void (*{func_name_prefix}_write)(uint32_t * {device_name}_base, uint{size}_t data);'
-            read_func = f'    uint{size}_t (*{func_name_prefix}_read)(uint32_t  *{device_name}_base);'
+def shadowed_registers(accessors: t.List[FieldAccessor]) \
+        -> t.List[RegisterAccessor]:
+    """
+    :param accessors: the accessors of the fields of the device
+    :return: the accessors of every register with a shadow copy, in order
+    """
+    return [register for register in make_register_accessors(accessors)
+            if register.shadowed]
 
-            rv.append(write_func)
-            rv.append(read_func)
 
-    return '\n'.join(rv)
+def c_constant(value: int, size: int) -> str:
+    """
+    :return: an unsigned C integer constant of the value, wide enough for a
+        register of the given size
+    """
+    return f'{value:#x}ULL' if size > 32 else f'{value:#x}U'
 
 
-def generate_metal_vtable_definition(devices_name: str) -> str:
+def accessor_names(device: str,
+                   accessor: t.Union[FieldAccessor, RegisterAccessor]) \
+        -> t.Dict[str, t.Union[str, int]]:
+    """
+    :return: the names substituted into the templates of the functions of
+        a field or register
+    """
+    register = accessor.register \
+        if isinstance(accessor, FieldAccessor) else accessor
+    names = dict(device=device, func_name=accessor.func_name,
+                 size=accessor.size, offset=f'{accessor.offset:#x}',
+                 shadow_param='', shadow_arg='')
+    if register.shadowed:
+        # The functions of shadowed registers also take the shadow copy of
+        # the register.
+        names.update(shadow_param=f', uint{register.size}_t *shadow',
+                     shadow_arg=f', &{device}->shadow->{register.name}')
+    if isinstance(accessor, FieldAccessor):
+        names.update(shift=accessor.shift,
+                     mask=c_constant(accessor.mask, accessor.size))
+    return names
+
+
+def generate_metal_vtable_definition(devices_name: str,
+                                     shadow: bool = False) -> str:
     """
     Generate the vtable and base address variable definitions
     for the given device name
 
     :param devices_name:
+    :param shadow: If True, also point to the shadow registers
     :return: The c code for the metal device
     """
 
-    return f'    uint32_t *{devices_name}_base;\n' + \
-           f'    struct metal_{devices_name}_vtable vtable;'
+    definition = f'    uint32_t *{devices_name}_base;\n' + \
+                 f'    const struct metal_{devices_name}_vtable *vtable;'
+    if shadow:
+        definition += f'\n    struct metal_{devices_name}_shadow *shadow;'
+    return definition
+
+
+# The per-field templates of the driver functions.
+# Registers are accessed with a single volatile load or store of their own
+# width, at the offset of their address block plus their address offset
+# from the DUH document. The masks and shifts of the fields are constants.
+
+BASE_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    void {func_name}_write(uint32_t *{device}_base, uint{size}_t data)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)(control_base + {offset});
+        *register_base = (*register_base & ~{mask}) | (((uint{size}_t)data << {shift}) & {mask});
+    }}
+    """)
+
+BASE_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    uint{size}_t {func_name}_read(uint32_t *{device}_base)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)(control_base + {offset});
+        return (*register_base & {mask}) >> {shift};
+    }}
+    """)
+
+METAL_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    void metal_{func_name}_write(const struct metal_{device} *{device}, uint{size}_t data)
+    {{
+        if ({device} != NULL)
+            {device}->vtable->v_{func_name}_write({device}->{device}_base{shadow_arg}, data);
+    }}
+    """)
+
+METAL_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    uint{size}_t metal_{func_name}_read(const struct metal_{device} *{device})
+    {{
+        if ({device} != NULL)
+            return {device}->vtable->v_{func_name}_read({device}->{device}_base{shadow_arg});
+        return (uint{size}_t)-1;
+    }}
+    """)
+
+# The per-register templates of the driver functions, which access all the
+# fields of a register with a single read and/or write.
+
+BASE_REGISTER_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    uint{size}_t {func_name}_register_read(uint32_t *{device}_base)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)(control_base + {offset});
+        return *register_base;
+    }}
+    """)
+
+BASE_REGISTER_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    void {func_name}_register_write(uint32_t *{device}_base, uint{size}_t value)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)(control_base + {offset});
+        *register_base = value;
+    }}
+    """)
+
+BASE_REGISTER_UPDATE_FUNC_TMPL = textwrap.dedent(
+    """
+    void {func_name}_register_update(uint32_t *{device}_base, uint{size}_t mask, uint{size}_t value)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)(control_base + {offset});
+        *register_base = (*register_base & ~mask) | (value & mask);
+    }}
+    """)
+
+METAL_REGISTER_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    uint{size}_t metal_{func_name}_register_read(const struct metal_{device} *{device})
+    {{
+        if ({device} != NULL)
+            return {device}->vtable->v_{func_name}_register_read({device}->{device}_base{shadow_arg});
+        return (uint{size}_t)-1;
+    }}
+    """)
+
+METAL_REGISTER_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    void metal_{func_name}_register_write(const struct metal_{device} *{device}, uint{size}_t value)
+    {{
+        if ({device} != NULL)
+            {device}->vtable->v_{func_name}_register_write({device}->{device}_base{shadow_arg}, value);
+    }}
+    """)
+
+METAL_REGISTER_UPDATE_FUNC_TMPL = textwrap.dedent(
+    """
+    void metal_{func_name}_register_update(const struct metal_{device} *{device}, uint{size}_t mask, uint{size}_t value)
+    {{
+        if ({device} != NULL)
+            {device}->vtable->v_{func_name}_register_update({device}->{device}_base{shadow_arg}, mask, value);
+    }}
+    """)
+
+# The templates of the private functions of the shadowed registers, which
+# keep a copy of the register in RAM, so that they never read the hardware
+# register: writes update the shadow, then store it to the hardware.
+
+BASE_SHADOW_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    void {func_name}_write(uint32_t *{device}_base, uint{size}_t *shadow, uint{size}_t data)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        *shadow = (*shadow & ~{mask}) | (((uint{size}_t)data << {shift}) & {mask});
+        *(volatile uint{size}_t *)(control_base + {offset}) = *shadow;
+    }}
+    """)
+
+BASE_SHADOW_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    uint{size}_t {func_name}_read(uint32_t *{device}_base, uint{size}_t *shadow)
+    {{
+        (void){device}_base;
+        return (*shadow & {mask}) >> {shift};
+    }}
+    """)
+
+BASE_SHADOW_REGISTER_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    uint{size}_t {func_name}_register_read(uint32_t *{device}_base, uint{size}_t *shadow)
+    {{
+        (void){device}_base;
+        return *shadow;
+    }}
+    """)
+
+BASE_SHADOW_REGISTER_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    void {func_name}_register_write(uint32_t *{device}_base, uint{size}_t *shadow, uint{size}_t value)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        *shadow = value;
+        *(volatile uint{size}_t *)(control_base + {offset}) = value;
+    }}
+    """)
+
+BASE_SHADOW_REGISTER_UPDATE_FUNC_TMPL = textwrap.dedent(
+    """
+    void {func_name}_register_update(uint32_t *{device}_base, uint{size}_t *shadow, uint{size}_t mask, uint{size}_t value)
+    {{
+        uintptr_t control_base = (uintptr_t){device}_base;
+        *shadow = (*shadow & ~mask) | (value & mask);
+        *(volatile uint{size}_t *)(control_base + {offset}) = *shadow;
+    }}
+    """)
+
+
+# Each of the per-field sections below is generated one line or function at
+# a time, as it is written, from the accessors computed once per field.
 
+def generate_vtable_declarations(device: str,
+                                 accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generate the vtable entries for a device and set of registers. This
+    creates the declarations for function pointers for all the driver functions.
+    This is used to provide a single point for all functions that can be used
+    for multiple devices.
 
-def generate_protos(device_name: str, reg_list: t.List[Register], include_address_block: bool) -> str:
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c code for the vtable entries
+    """
+    for accessor in accessors:
+        func_name = accessor.func_name
+        size = accessor.size
+        shadow = accessor_names(device, accessor)['shadow_param']
+        yield f'    void (*v_{func_name}_write)(uint32_t * {device}_base{shadow}, uint{size}_t data);'
+        yield f'    uint{size}_t (*v_{func_name}_read)(uint32_t  *{device}_base{shadow});'
+
+    for register in make_register_accessors(accessors):
+        func_name = register.func_name
+        size = register.size
+        shadow = accessor_names(device, register)['shadow_param']
+        yield f'    uint{size}_t (*v_{func_name}_register_read)(uint32_t *{device}_base{shadow});'
+        yield f'    void (*v_{func_name}_register_write)(uint32_t *{device}_base{shadow}, uint{size}_t value);'
+        yield f'    void (*v_{func_name}_register_update)(uint32_t *{device}_base{shadow}, uint{size}_t mask, uint{size}_t value);'
+
+
+def generate_protos(device: str,
+                    accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
     """
     Generate the function prototypes for a given device and register list.
 
-    :param device_name: The device name
-    :param reg_list: the list of registers for the device
-    :param include_address_block: If True, include the address block name in
-        the generated C function prototypes.
-    :return: the c language prototypes for the device
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c language prototypes for the device
     """
+    dev_struct = f'const struct metal_{device} *{device}'
 
-    rv = []
+    for accessor in accessors:
+        func_name = accessor.func_name
+        size = accessor.size
+        yield f'void metal_{func_name}_write({dev_struct}, uint{size}_t data);'
+        yield f'uint{size}_t metal_{func_name}_read({dev_struct});'
 
-    dev_struct = f'const struct metal_{device_name} *{device_name}'
+    for register in make_register_accessors(accessors):
+        func_name = register.func_name
+        size = register.size
+        yield f'uint{size}_t metal_{func_name}_register_read({dev_struct});'
+        yield f'void metal_{func_name}_register_write({dev_struct}, uint{size}_t value);'
+        yield f'void metal_{func_name}_register_update({dev_struct}, uint{size}_t mask, uint{size}_t value);'
 
-    for a_reg in reg_list:
-        address_block_name = a_reg.address_block.name.lower()
-        for field in a_reg.fields:
-            reg_name = a_reg.name.lower()
-            field_name = field.name.lower()
-            size = a_reg.width
+    if shadowed_registers(accessors):
+        yield f'void metal_{device}_shadow_resync({dev_struct});'
+        yield f'void metal_{device}_shadow_flush({dev_struct});'
+
+    yield f'const struct metal_{device} *get_metal_{device}(uint8_t index);'
 
-            if include_address_block:
-                func_name_prefix = f'metal_{device_name}_{address_block_name}_{reg_name}_{field_name}'
-            else:
-                func_name_prefix = f'metal_{device_name}_{reg_name}_{field_name}'
 
-            write_func = f'void {func_name_prefix}_write({dev_struct}, uint{size}_t data);'
-            read_func = f'uint{size}_t {func_name_prefix}_read({dev_struct});'
+def generate_def_vtable(device: str,
+                        accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generate the initializers of the vtable shared by every instance of the
+    device in the .c file
 
-            rv.append(write_func)
-            rv.append(read_func)
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the designated initializers of the vtable for
+        the driver .c file
+    """
+    indent = ''
+    for accessor in accessors:
+        func_name = accessor.func_name
+        yield f'{indent}.v_{func_name}_write = {func_name}_write,'
+        indent = ' ' * 4
+        yield f'{indent}.v_{func_name}_read = {func_name}_read,'
+
+    for register in make_register_accessors(accessors):
+        func_name = register.func_name
+        for operation in ('read', 'write', 'update'):
+            yield f'{indent}.v_{func_name}_register_{operation} = {func_name}_register_{operation},'
+            indent = ' ' * 4
+
+
+def generate_base_functions(device: str,
+                            accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generates the basic, not exported register access functions for
+    a given device and register list.
+
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c code for the register access functions
+    """
+    for accessor in accessors:
+        names = accessor_names(device, accessor)
+        if accessor.register.shadowed:
+            yield BASE_SHADOW_WRITE_FUNC_TMPL.format(**names)
+            yield BASE_SHADOW_READ_FUNC_TMPL.format(**names)
+        else:
+            yield BASE_WRITE_FUNC_TMPL.format(**names)
+            yield BASE_READ_FUNC_TMPL.format(**names)
+
+    for register in make_register_accessors(accessors):
+        names = accessor_names(device, register)
+        if register.shadowed:
+            yield BASE_SHADOW_REGISTER_READ_FUNC_TMPL.format(**names)
+            yield BASE_SHADOW_REGISTER_WRITE_FUNC_TMPL.format(**names)
+            yield BASE_SHADOW_REGISTER_UPDATE_FUNC_TMPL.format(**names)
+        else:
+            yield BASE_REGISTER_READ_FUNC_TMPL.format(**names)
+            yield BASE_REGISTER_WRITE_FUNC_TMPL.format(**names)
+            yield BASE_REGISTER_UPDATE_FUNC_TMPL.format(**names)
+
+
+def generate_metal_function(device: str,
+                            accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generates the exported register access functions for
+    a given device and register list.
+
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c code for the exported register access
+        functions
+    """
+    for accessor in accessors:
+        names = accessor_names(device, accessor)
+        yield METAL_WRITE_FUNC_TMPL.format(**names)
+        yield METAL_READ_FUNC_TMPL.format(**names)
 
-    get_device = f'const struct metal_{device_name} *get_metal_{device_name}' \
-                 f'(uint8_t index);'
-    rv.append(get_device)
+    for register in make_register_accessors(accessors):
+        names = accessor_names(device, register)
+        yield METAL_REGISTER_READ_FUNC_TMPL.format(**names)
+        yield METAL_REGISTER_WRITE_FUNC_TMPL.format(**names)
+        yield METAL_REGISTER_UPDATE_FUNC_TMPL.format(**names)
 
-    return '\n'.join(rv)
+    registers = shadowed_registers(accessors)
+    if registers:
+        yield from generate_shadow_functions(device, registers)
+
+
+def generate_shadow_functions(device: str,
+                              registers: t.List[RegisterAccessor]) \
+        -> t.Iterator[str]:
+    """
+    Generates the functions copying the shadow registers of an instance
+    from and to the hardware.
+
+    :param device: the name of the device
+    :param registers: the accessors of the shadowed registers of the device
+    :return: an iterator of the c code for the functions
+    """
+    def register_pointer(register: RegisterAccessor) -> str:
+        return f'(volatile uint{register.size}_t *)(control_base + {register.offset:#x})'
+
+    # Registers which cannot be read back keep their shadow.
+    resync = [f'    {device}->shadow->{register.name} = *{register_pointer(register)};'
+              for register in registers if register.readable]
+    flush = [f'    *{register_pointer(register)} = {device}->shadow->{register.name};'
+             for register in registers]
+
+    for name, statements in (('resync', resync), ('flush', flush)):
+        yield ''
+        yield f'void metal_{device}_shadow_{name}(const struct metal_{device} *{device})'
+        yield '{'
+        if statements:
+            yield f'    uintptr_t control_base;'
+            yield ''
+            yield f'    if ({device} == NULL)'
+            yield f'        return;'
+            yield f'    control_base = (uintptr_t){device}->{device}_base;'
+            yield from statements
+        else:
+            yield f'    (void){device};'
+        yield '}'
+
+
+def generate_shadow_struct(device: str,
+                           accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generate the members of the struct holding the shadow registers of an
+    instance of the device.
+
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c code for the members
+    """
+    for register in shadowed_registers(accessors):
+        yield f'    uint{register.size}_t {register.name};'
+
+
+def generate_shadow_reset(device: str,
+                          accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generate the designated initializers of the shadow registers of an
+    instance, to the reset values of the registers.
+
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the initializers
+    """
+    for register in shadowed_registers(accessors):
+        reset_value = c_constant(register.reset_value, register.size)
+        yield f'    .{register.name} = {reset_value}, \\'
+
+
+def generate_field_masks(device: str,
+                         accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generate the compile-time mask of each register field, and a macro
+    shifting a value into the field, for the register write and update
+    functions.
+
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c macros for the fields of the device
+    """
+    for accessor in accessors:
+        name = f'METAL_{accessor.func_name.upper()}'
+        size = accessor.size
+        yield f'#define {name}_MASK ((uint{size}_t){c_constant(accessor.mask, size)})'
+        yield f'#define {name}(value) ((uint{size}_t)(((uint64_t)(value) << {accessor.shift}) & {name}_MASK))'
 
 
 # The template for the .h file
@@ -181,7 +676,7 @@ METAL_DEV_HDR_TMPL = \
 
     struct metal_${device};
 
-    struct metal_${device}_vtable {
+    ${shadow_struct}struct metal_${device}_vtable {
     ${vtable}
     };
 
@@ -190,35 +685,243 @@ METAL_DEV_HDR_TMPL = \
     };
 
     //__METAL_DECLARE_VTABLE(metal_${device})
+
+    // The mask of each register field, and its value shifted into place, to
+    // set several fields of a register with a single read and write, e.g.
+    // metal_${device}_<register>_register_update(${device},
+    //     METAL_<FIELD1>_MASK | METAL_<FIELD2>_MASK,
+    //     METAL_<FIELD1>(value1) | METAL_<FIELD2>(value2));
+    ${field_masks}
         
     ${protos}
-    #endif
+    ${inline_accessors}#endif
     """
 
+# The shadow registers, defined in the .h file when any register is shadowed.
+METAL_DEV_HDR_SHADOW_TMPL = \
+    """
+    // The copies, kept in RAM, of the registers which the driver never reads
+    // from the hardware. Each instance has its own, initialized to the reset
+    // values of the registers. metal_${device}_shadow_resync() reloads the
+    // readable ones from the hardware, e.g. after the hardware changed them,
+    // and metal_${device}_shadow_flush() stores all of them to the hardware,
+    // e.g. after a reset. The inline accessors of a shadowed register also
+    // take a pointer to its shadow, e.g.
+    // &get_metal_${device}(0)->shadow-><register>.
+    struct metal_${device}_shadow {
+    ${members}
+    };
+
+    """
 
-def generate_metal_dev_hdr(vendor, device, index, reglist, include_address_block: bool):
+# The inline accessors, appended to the .h file with --accessors=inline.
+METAL_DEV_HDR_INLINE_TMPL = \
+    """
+
+    // Inline register field access functions
+    //
+    // These take the base address of an instance, e.g. from
+    // ${cap_device}_BASES, instead of a struct metal_${device}. The register
+    // offsets and field masks are compile-time constants, so each access
+    // compiles down to a load, a mask and, for writes, a store.
+    ${functions}
+    """
+
+INLINE_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline void {func_name}_write_inline(uintptr_t {device}_base, uint{size}_t data)
+    {{
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)({device}_base + {offset});
+        *register_base = (*register_base & ~{mask}) | (((uint{size}_t)data << {shift}) & {mask});
+    }}
+    """)
+
+INLINE_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline uint{size}_t {func_name}_read_inline(uintptr_t {device}_base)
+    {{
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)({device}_base + {offset});
+        return (*register_base & {mask}) >> {shift};
+    }}
+    """)
+
+INLINE_REGISTER_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline uint{size}_t {func_name}_register_read_inline(uintptr_t {device}_base)
+    {{
+        return *(volatile uint{size}_t *)({device}_base + {offset});
+    }}
+    """)
+
+INLINE_REGISTER_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline void {func_name}_register_write_inline(uintptr_t {device}_base, uint{size}_t value)
+    {{
+        *(volatile uint{size}_t *)({device}_base + {offset}) = value;
+    }}
+    """)
+
+INLINE_REGISTER_UPDATE_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline void {func_name}_register_update_inline(uintptr_t {device}_base, uint{size}_t mask, uint{size}_t value)
+    {{
+        volatile uint{size}_t *register_base = (volatile uint{size}_t *)({device}_base + {offset});
+        *register_base = (*register_base & ~mask) | (value & mask);
+    }}
+    """)
+
+INLINE_SHADOW_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline void {func_name}_write_inline(uintptr_t {device}_base, uint{size}_t *shadow, uint{size}_t data)
+    {{
+        *shadow = (*shadow & ~{mask}) | (((uint{size}_t)data << {shift}) & {mask});
+        *(volatile uint{size}_t *)({device}_base + {offset}) = *shadow;
+    }}
+    """)
+
+INLINE_SHADOW_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline uint{size}_t {func_name}_read_inline(uintptr_t {device}_base, const uint{size}_t *shadow)
+    {{
+        (void){device}_base;
+        return (*shadow & {mask}) >> {shift};
+    }}
+    """)
+
+INLINE_SHADOW_REGISTER_READ_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline uint{size}_t {func_name}_register_read_inline(uintptr_t {device}_base, const uint{size}_t *shadow)
+    {{
+        (void){device}_base;
+        return *shadow;
+    }}
+    """)
+
+INLINE_SHADOW_REGISTER_WRITE_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline void {func_name}_register_write_inline(uintptr_t {device}_base, uint{size}_t *shadow, uint{size}_t value)
+    {{
+        *shadow = value;
+        *(volatile uint{size}_t *)({device}_base + {offset}) = value;
+    }}
+    """)
+
+INLINE_SHADOW_REGISTER_UPDATE_FUNC_TMPL = textwrap.dedent(
+    """
+    static inline void {func_name}_register_update_inline(uintptr_t {device}_base, uint{size}_t *shadow, uint{size}_t mask, uint{size}_t value)
+    {{
+        *shadow = (*shadow & ~mask) | (value & mask);
+        *(volatile uint{size}_t *)({device}_base + {offset}) = *shadow;
+    }}
+    """)
+
+
+def generate_inline_functions(device: str,
+                              accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generates the static inline register access functions for a given
+    device and register list.
+
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c code for the inline functions
+    """
+    for accessor in accessors:
+        names = accessor_names(device, accessor)
+        if accessor.register.shadowed:
+            yield INLINE_SHADOW_WRITE_FUNC_TMPL.format(**names)
+            yield INLINE_SHADOW_READ_FUNC_TMPL.format(**names)
+        else:
+            yield INLINE_WRITE_FUNC_TMPL.format(**names)
+            yield INLINE_READ_FUNC_TMPL.format(**names)
+
+    for register in make_register_accessors(accessors):
+        names = accessor_names(device, register)
+        if register.shadowed:
+            yield INLINE_SHADOW_REGISTER_READ_FUNC_TMPL.format(**names)
+            yield INLINE_SHADOW_REGISTER_WRITE_FUNC_TMPL.format(**names)
+            yield INLINE_SHADOW_REGISTER_UPDATE_FUNC_TMPL.format(**names)
+        else:
+            yield INLINE_REGISTER_READ_FUNC_TMPL.format(**names)
+            yield INLINE_REGISTER_WRITE_FUNC_TMPL.format(**names)
+            yield INLINE_REGISTER_UPDATE_FUNC_TMPL.format(**names)
+
+
+def generate_metal_dev_hdr(vendor, device, index,
+                           accessors: t.List[FieldAccessor],
+                           out: t.Optional[t.TextIO] = None,
+                           inline_accessors: bool = False):
     """
 
     :param vendor: The name of the vendor creating the device
     :param device: the name of the device created.
     :param index: the index of the device
-    :param reglist: the list of registers for the device
-    :return: a string which is the .h for file the device driver
+    :param accessors: the accessors of the fields of the device
+    :param out: if given, the stream to write the .h file to as it is
+        generated
+    :param inline_accessors: If True, also define static inline accessors,
+        which bypass the vtable
+    :return: a string which is the .h for file the device driver, or None if
+        written to out
     """
+    if out is None:
+        out = io.StringIO()
+        generate_metal_dev_hdr(vendor, device, index, accessors, out,
+                               inline_accessors)
+        return out.getvalue()
+
+    inline_section: streaming.Section = ''
+    if inline_accessors:
+        inline_template = string.Template(
+            textwrap.dedent(METAL_DEV_HDR_INLINE_TMPL)[1:])
+
+        def inline_section(out: t.TextIO) -> None:
+            streaming.write_template(out, inline_template, dict(
+                device=device,
+                cap_device=device.upper(),
+                functions=generate_inline_functions(device, accessors),
+            ))
+
+    shadow = bool(shadowed_registers(accessors))
+    shadow_section: streaming.Section = ''
+    if shadow:
+        shadow_template = string.Template(
+            textwrap.dedent(METAL_DEV_HDR_SHADOW_TMPL)[1:])
+
+        def shadow_section(out: t.TextIO) -> None:
+            streaming.write_template(out, shadow_template, dict(
+                device=device,
+                members=generate_shadow_struct(device, accessors),
+            ))
+
     template = string.Template(textwrap.dedent(METAL_DEV_HDR_TMPL))
 
-    return template.substitute(
+    streaming.write_template(out, template, dict(
         vendor=vendor,
         device=device,
         cap_device=device.upper(),
         index=str(index),
         # base_address=hex(base_address),
-        vtable=generate_vtable_declarations(device, reglist,
-                                            include_address_block=include_address_block),
-        metal_device=generate_metal_vtable_definition(device),
-        protos=generate_protos(device, reglist, include_address_block=include_address_block)
-    )
+        shadow_struct=shadow_section,
+        vtable=generate_vtable_declarations(device, accessors),
+        metal_device=generate_metal_vtable_definition(device, shadow),
+        field_masks=generate_field_masks(device, accessors),
+        protos=generate_protos(device, accessors),
+        inline_accessors=inline_section,
+    ))
+    return None
+
+
+# The reset values of the shadow registers, in the .c file when any register
+# is shadowed. Each instance points to its own copy, a compound literal.
+METAL_DEV_DRV_SHADOW_TMPL = \
+    """
+    // The reset values of the shadow registers of an instance
+    #define __METAL_${cap_device}_SHADOW_RESET { \\
+    ${initializers}
+    }
 
+    """
 
 # the template for the driver .c file
 METAL_DEV_DRV_TMPL = \
@@ -230,36 +933,6 @@ METAL_DEV_DRV_TMPL = \
     #include <metal/compiler.h>
     #include <metal/io.h>
 
-    // Private utility functions
-
-    // Write data into register field by only changing bits within that field.
-    static inline void write_field(
-        volatile uint32_t *register_base,
-        uint32_t field_offset,
-        uint32_t field_width,
-        uint32_t field_data
-    ) {
-        const uint32_t shifted_field_data = field_data << field_offset;
-        const uint32_t mask = (field_width == 32) ? 0xffffffff : ((1 << field_width) - 1) << field_offset;
-        const uint32_t original_data = *register_base;
-
-        const uint32_t cleared_data = original_data & (~mask);
-        const uint32_t new_data = cleared_data | shifted_field_data;
-
-        *register_base = new_data;
-    }
-
-    // Read data from register field by shifting and masking only that field.
-    static inline uint32_t read_field(
-        volatile uint32_t *register_base,
-        uint32_t field_offset,
-        uint32_t field_width
-    ) {
-        const uint32_t original_data = *register_base;
-        const uint32_t mask = (field_width == 32) ? 0xffffffff : (1 << field_width) - 1;
-        return (original_data >> field_offset) & mask;
-    }
-
     // Private register field access functions
     ${base_functions}
 
@@ -267,321 +940,540 @@ METAL_DEV_DRV_TMPL = \
     ${metal_functions}
 
     // Static data
-    struct metal_${device} metal_${device}s[${cap_device}_COUNT];
-    
-    struct metal_${device}* ${device}_tables[${cap_device}_COUNT];
-    uint8_t ${device}_tables_cnt = ${cap_device}_COUNT;
 
-    static void init_devices()
-    {
-        uint32_t bases[]=${cap_device}_BASES;
-        int i;
-        
-        for (i = 0; i < ${cap_device}_COUNT; i++){
-            ${def_vtable}
-            ${device}_tables[i] = &metal_${device}s[i];
-        }
-    }
+    // The vtable shared by every instance of the device
+    static const struct metal_${device}_vtable metal_${device}_vtable = {
+        ${def_vtable}
+    };
+
+    ${shadow_reset}#define __METAL_${cap_device}_INSTANCE(base) \\
+        { (uint32_t *)(uintptr_t)(base), &metal_${device}_vtable${instance_shadow} },
+
+    const struct metal_${device} metal_${device}s[${cap_device}_COUNT] = {
+        ${cap_device}_BASES_FOREACH(__METAL_${cap_device}_INSTANCE)
+    };
 
     const struct metal_${device}* get_metal_${device}(uint8_t idx)
     {
-        static uint8_t initted = 0;
-        
-        if (!initted){
-            init_devices();
-            initted = 1;
-        }
-        
-        if (idx >= ${device}_tables_cnt)
+        if (idx >= ${cap_device}_COUNT)
             return NULL;
-        return ${device}_tables[idx];
+        return &metal_${device}s[idx];
     }
     """
 
 
-def generate_def_vtable(device: str, reg_list: t.List[Register], include_address_block: bool) -> str:
+def generate_metal_dev_drv(vendor, device, index,
+                           accessors: t.List[FieldAccessor],
+                           out: t.Optional[t.TextIO] = None):
     """
-    Generate vtable settings for vtable declaration in .c file
+    Generate the driver source file contents for a given device
+    and register list
 
-    :param device: the name of the device
-    :param reg_list: the register list for the device
-    :param include_address_block: If True, include the address block name in
-        the generated C function prototypes.
-    :return: the declarations in the vtable for the driver .c file
+    :param vendor: the vendor creating the device
+    :param device: the device
+    :param index: the index of the device used
+    :param accessors: the accessors of the fields of the device
+    :param out: if given, the stream to write the driver to as it is
+        generated
+    :return: a string containing of the c code for the basic driver, or None
+        if written to out
     """
-    rv: t.List[str] = []
-    head = f'metal_{device}s[i].{device}_base = bases[i];'
-    rv.append(head)
-    for a_reg in reg_list:
-        address_block_name = a_reg.address_block.name.lower()
-        for field in a_reg.fields:
-            reg_name = a_reg.name.lower()
-            field_name = field.name.lower()
-            if include_address_block:
-                vtable_prefix = f'v_{device}_{address_block_name}_{reg_name}_{field_name}'
-                base_func_prefix = f'{device}_{address_block_name}_{reg_name}_{field_name}'
-            else:
-                vtable_prefix = f'v_{device}_{reg_name}_{field_name}'
-                base_func_prefix = f'{device}_{reg_name}_{field_name}'
-            write_func = f'{" " * 8}metal_{device}s[i].vtable.{vtable_prefix}_write = {base_func_prefix}_write;'
-            read_func = f'{" " * 8}metal_{device}s[i].vtable.{vtable_prefix}_read = {base_func_prefix}_read;'
-            rv.append(write_func)
-            rv.append(read_func)
+    if out is None:
+        out = io.StringIO()
+        generate_metal_dev_drv(vendor, device, index, accessors, out)
+        return out.getvalue()
 
-    return '\n'.join(rv)
+    cap_device = device.upper()
+    shadow_section: streaming.Section = ''
+    instance_shadow = ''
+    if shadowed_registers(accessors):
+        shadow_template = string.Template(
+            textwrap.dedent(METAL_DEV_DRV_SHADOW_TMPL)[1:])
+
+        def shadow_section(out: t.TextIO) -> None:
+            streaming.write_template(out, shadow_template, dict(
+                cap_device=cap_device,
+                initializers=generate_shadow_reset(device, accessors),
+            ))
 
+        instance_shadow = f', &(struct metal_{device}_shadow)__METAL_{cap_device}_SHADOW_RESET'
 
-def generate_base_functions(device: str, reg_list: t.List[Register], include_address_block: bool) -> str:
+    template = string.Template(textwrap.dedent(METAL_DEV_DRV_TMPL))
+
+    streaming.write_template(out, template, dict(
+        vendor=vendor,
+        device=device,
+        cap_device=cap_device,
+        index=str(index),
+        base_functions=generate_base_functions(device, accessors),
+        metal_functions=generate_metal_function(device, accessors),
+        def_vtable=generate_def_vtable(device, accessors),
+        shadow_reset=shadow_section,
+        instance_shadow=instance_shadow,
+    ))
+    return None
+
+
+# ###
+# Table-driven drivers
+#
+# With --driver-style=table, a driver is one const array describing every
+# register field and a fixed set of generic accessors, indexed by an enum of
+# the fields, so that its code size does not grow with the number of fields.
+# ###
+
+def generate_field_enumerators(device: str,
+                               accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
     """
-    Generates the basic, not exported register access functions for
-    a given device and register list.
+    Generate the enumerators of the fields of a device.
 
     :param device: the name of the device
-    :param reg_list: the list of registers for the device.
-    :param include_address_block: If True, include the address block name in
-        the generated C macros.
-    :return:  the c code for the register access functions
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the c code for the enumerators
     """
-    cap_device = device.upper()
-    rv: t.List[str] = []
-
-    for a_reg in reg_list:
-        address_block = a_reg.address_block
-        address_block_name = address_block.name.lower()
-        cap_addr_block_name = address_block.name.upper()
-        for field in a_reg.fields:
-            name = a_reg.name.lower()
-            cap_name = a_reg.name.upper()
-            field_name = field.name.lower()
-            cap_field_name = field.name.upper()
-            size = a_reg.width
-
-            # Compute actual register offset by assuming 32-bit registers,
-            # since the existing header macros do not directly tell you the
-            # offset of the registers.
-
-            if include_address_block:
-                macro_prefix = f"{cap_device}_REGISTER_{cap_addr_block_name}_{cap_name}_{cap_field_name}"
-                func_prefix = f"{device}_{address_block_name}_{name}_{field_name}"
-            else:
-                macro_prefix = f"{cap_device}_REGISTER_{cap_name}_{cap_field_name}"
-                func_prefix = f"{device}_{name}_{field_name}"
+    for accessor in accessors:
+        yield f'    METAL_{accessor.func_name.upper()}_FIELD,'
 
-            # Bit offset of field relative to base of device register block
-            field_bit_offset_from_base = macro_prefix
 
-            # Byte offset of register relative to base of device register block
-            reg_byte_offset = f"(({field_bit_offset_from_base} / 32) * 4)"
-
-            # Bit offset of field relative to base of register
-            field_bit_offset_from_register = f"({field_bit_offset_from_base} % 32)"
-            field_width = f"{macro_prefix}_WIDTH"
+def generate_field_descriptors(device: str,
+                               accessors: t.List[FieldAccessor]) -> t.Iterator[str]:
+    """
+    Generate the initializers of the descriptors of the fields of a device.
 
-            write_func = f"""
-                void {func_prefix}_write(uint32_t *{device}_base, uint{size}_t data)
-                {{
-                    uintptr_t control_base = (uintptr_t){device}_base;
-                    volatile uint32_t *register_base = (uint32_t *)(control_base + {reg_byte_offset});
-                    write_field(register_base, {field_bit_offset_from_register}, {field_width}, data);
-                }}
-                """
+    :param device: the name of the device
+    :param accessors: the accessors of the fields of the device
+    :return: an iterator of the designated initializers of the descriptor
+        array in the driver .c file
+    """
+    indent = ''
+    for accessor in accessors:
+        yield f'{indent}[METAL_{accessor.func_name.upper()}_FIELD] = ' \
+              f'{{ {accessor.offset:#x}, {accessor.shift}, {accessor.width}, {accessor.size // 8} }},'
+        indent = ' ' * 4
 
-            rv.append(textwrap.dedent(write_func))
 
-            read_func = f"""
-                uint{size}_t {func_prefix}_read(uint32_t *{device}_base)
-                {{
-                    uintptr_t control_base = (uintptr_t){device}_base;
-                    volatile uint32_t *register_base = (uint32_t *)(control_base + {reg_byte_offset});
-                    return read_field(register_base, {field_bit_offset_from_register}, {field_width});
-                }}
-                """
+METAL_DEV_TABLE_HDR_TMPL = \
+    """
+    #include <metal/compiler.h>
+    #include <stdint.h>
+    #include <stdlib.h>
+    #include <bsp_${device}/${vendor}_${device}.h>
 
-            rv.append(textwrap.dedent(read_func))
+    #ifndef ${vendor}_${device}${index}_h
+    #define ${vendor}_${device}${index}_h
 
-    return '\n'.join(rv)
+    struct metal_${device} {
+        uint32_t *${device}_base;
+    };
 
+    // The register fields of the device, for metal_${device}_field_read()
+    // and metal_${device}_field_write()
+    enum metal_${device}_field {
+    ${fields}
+        METAL_${cap_device}_FIELD_COUNT
+    };
 
-def generate_metal_function(device: str, reg_list: t.List[Register], include_address_block: bool) -> str:
+    uint64_t metal_${device}_field_read(const struct metal_${device} *${device}, enum metal_${device}_field field);
+    void metal_${device}_field_write(const struct metal_${device} *${device}, enum metal_${device}_field field, uint64_t data);
+    const struct metal_${device} *get_metal_${device}(uint8_t index);
+    #endif
     """
-    Generates the exported register access functions for
-    a given device and register list.
 
-    :param device: the name of the device
-    :param reg_list: the list of registers for the device.
-    :param include_address_block: If True, include the address block name in
-        the generated C function prototypes.
-    :return:  the c code for the exported register access functions
+METAL_DEV_TABLE_DRV_TMPL = \
     """
+    #include <stdint.h>
+    #include <stdlib.h>
+
+    #include <${device}/${vendor}_${device}${index}.h>
+    #include <metal/compiler.h>
+    #include <metal/io.h>
 
-    rv: t.List[str] = []
+    // The location of a register field
+    struct metal_${device}_field_desc {
+        uint32_t offset; // of the register from the base of the device, in bytes
+        uint8_t shift; // of the field within the register, in bits
+        uint8_t width; // of the field, in bits
+        uint8_t size; // of the register, in bytes
+    };
 
-    for a_reg in reg_list:
-        address_block_name = a_reg.address_block.name.lower()
-        for field in a_reg.fields:
-            name = a_reg.name.lower()
-            field_name = field.name.lower()
-            size = a_reg.width
+    static const struct metal_${device}_field_desc metal_${device}_fields[METAL_${cap_device}_FIELD_COUNT] = {
+        ${descriptors}
+    };
 
-            if include_address_block:
-                func_name = f"{device}_{address_block_name}_{name}_{field_name}"
-            else:
-                func_name = f"{device}_{name}_{field_name}"
+    // Private utility functions
+
+    // Read a register with a single access of its own width.
+    static uint64_t load_register(uintptr_t address, uint8_t size)
+    {
+        switch (size) {
+        case 1:
+            return *(volatile uint8_t *)address;
+        case 2:
+            return *(volatile uint16_t *)address;
+        case 4:
+            return *(volatile uint32_t *)address;
+        default:
+            return *(volatile uint64_t *)address;
+        }
+    }
+
+    // Write a register with a single access of its own width.
+    static void store_register(uintptr_t address, uint8_t size, uint64_t value)
+    {
+        switch (size) {
+        case 1:
+            *(volatile uint8_t *)address = (uint8_t)value;
+            break;
+        case 2:
+            *(volatile uint16_t *)address = (uint16_t)value;
+            break;
+        case 4:
+            *(volatile uint32_t *)address = (uint32_t)value;
+            break;
+        default:
+            *(volatile uint64_t *)address = value;
+            break;
+        }
+    }
 
-            write_func = f"""
-                void metal_{func_name}_write(const struct metal_{device} *{device}, uint{size}_t data)
-                {{
-                    if ({device} != NULL)
-                        {device}->vtable.v_{func_name}_write({device}->{device}_base, data);
-                }}
-                """
-            rv.append(textwrap.dedent(write_func))
+    // The mask of a field of the given width, at bit 0.
+    static uint64_t field_mask(uint8_t width)
+    {
+        return (2ULL << (width - 1)) - 1;
+    }
 
-            read_func = f"""
-                uint{size}_t metal_{func_name}_read(const struct metal_{device} *{device})
-                {{
-                    if ({device} != NULL)
-                        return {device}->vtable.v_{func_name}_read({device}->{device}_base);
-                    return (uint{size}_t)-1;
-                }}
-                """
+    // Public register field access functions
 
-            rv.append(textwrap.dedent(read_func))
+    uint64_t metal_${device}_field_read(const struct metal_${device} *${device}, enum metal_${device}_field field)
+    {
+        const struct metal_${device}_field_desc *desc;
+        uint64_t value;
+
+        if (${device} == NULL || field >= METAL_${cap_device}_FIELD_COUNT)
+            return (uint64_t)-1;
+        desc = &metal_${device}_fields[field];
+        value = load_register((uintptr_t)${device}->${device}_base + desc->offset, desc->size);
+        return (value >> desc->shift) & field_mask(desc->width);
+    }
 
-    return '\n'.join(rv)
+    void metal_${device}_field_write(const struct metal_${device} *${device}, enum metal_${device}_field field, uint64_t data)
+    {
+        const struct metal_${device}_field_desc *desc;
+        uintptr_t address;
+        uint64_t mask;
+        uint64_t value;
+
+        if (${device} == NULL || field >= METAL_${cap_device}_FIELD_COUNT)
+            return;
+        desc = &metal_${device}_fields[field];
+        address = (uintptr_t)${device}->${device}_base + desc->offset;
+        mask = field_mask(desc->width) << desc->shift;
+        value = load_register(address, desc->size);
+        store_register(address, desc->size, (value & ~mask) | ((data << desc->shift) & mask));
+    }
+
+    // Static data
 
+    #define __METAL_${cap_device}_INSTANCE(base) \\
+        { (uint32_t *)(uintptr_t)(base) },
 
-def generate_metal_dev_drv(vendor, device, index, reglist, include_address_block):
+    const struct metal_${device} metal_${device}s[${cap_device}_COUNT] = {
+        ${cap_device}_BASES_FOREACH(__METAL_${cap_device}_INSTANCE)
+    };
+
+    const struct metal_${device}* get_metal_${device}(uint8_t idx)
+    {
+        if (idx >= ${cap_device}_COUNT)
+            return NULL;
+        return &metal_${device}s[idx];
+    }
     """
-    Generate the driver source file contents for a given device
-    and register list
+
+
+def generate_metal_dev_table_hdr(vendor, device, index,
+                                 accessors: t.List[FieldAccessor],
+                                 out: t.Optional[t.TextIO] = None):
+    """
+    Generate the .h file of the table-driven driver of a device.
 
     :param vendor: the vendor creating the device
     :param device: the device
     :param index: the index of the device used
-    :param reglist: the list of registers
-    :param include_address_block: If True, include the address block name in
-        the generated C macros and function prototypes.
-    :return: a string containing of the c code for the basic driver
+    :param accessors: the accessors of the fields of the device
+    :param out: if given, the stream to write the .h file to as it is
+        generated
+    :return: a string which is the .h file, or None if written to out
     """
-    template = string.Template(textwrap.dedent(METAL_DEV_DRV_TMPL))
+    if out is None:
+        out = io.StringIO()
+        generate_metal_dev_table_hdr(vendor, device, index, accessors, out)
+        return out.getvalue()
 
-    return template.substitute(
+    template = string.Template(textwrap.dedent(METAL_DEV_TABLE_HDR_TMPL))
+
+    streaming.write_template(out, template, dict(
         vendor=vendor,
         device=device,
         cap_device=device.upper(),
         index=str(index),
-        base_functions=generate_base_functions(device, reglist,
-                                               include_address_block),
-        metal_functions=generate_metal_function(device, reglist,
-                                                include_address_block),
-        def_vtable=generate_def_vtable(device, reglist, include_address_block)
-    )
+        fields=generate_field_enumerators(device, accessors),
+    ))
+    return None
 
 
-# ###
-# Support for parsing duh file
-# ###
-
-def _jsonref_loader(uri: str, **kwargs) -> JSONType:
+def generate_metal_dev_table_drv(vendor, device, index,
+                                 accessors: t.List[FieldAccessor],
+                                 out: t.Optional[t.TextIO] = None):
     """
-    Custom jsonref loader that can handle relative file paths.
+    Generate the .c file of the table-driven driver of a device.
 
-    If the value of a JSON reference is a relative file path, load it relative
-    to the parent file containing the reference. Otherwise, delegate to the
-    normal jsonref loader.
+    :param vendor: the vendor creating the device
+    :param device: the device
+    :param index: the index of the device used
+    :param accessors: the accessors of the fields of the device
+    :param out: if given, the stream to write the driver to as it is
+        generated
+    :return: a string containing the c code for the driver, or None if
+        written to out
     """
-    parsed_uri = urlparse(uri)
-    # Assume that if netloc is present, then the URI is a web URI, and
-    # otherwise that the URI refers to a relative file path.
-    if parsed_uri.netloc:
-        return jsonref.jsonloader(uri, **kwargs)
-    else:
-        return json5.loads(Path(uri).read_text())
+    if out is None:
+        out = io.StringIO()
+        generate_metal_dev_table_drv(vendor, device, index, accessors, out)
+        return out.getvalue()
 
+    template = string.Template(textwrap.dedent(METAL_DEV_TABLE_DRV_TMPL))
 
-def load_json5_with_refs(f_name: str) -> JSONType:
-    with open(f_name) as fp:
-        return jsonref.JsonRef.replace_refs(
-            json5.load(fp),
-            base_uri=f_name,
-            loader=_jsonref_loader,
-        )
+    streaming.write_template(out, template, dict(
+        vendor=vendor,
+        device=device,
+        cap_device=device.upper(),
+        index=str(index),
+        descriptors=generate_field_descriptors(device, accessors),
+    ))
+    return None
 
 
-###
-# main
-###
+# ###
+# Support for parsing duh file
+# ###
 
+def _json5_cache_path(f_name: Path) -> Path:
+    return f_name.with_name(f'.{f_name.name}.json-cache')
 
-def handle_args():
-    """
-    :return:
-    """
-    parser = argparse.ArgumentParser()
 
-    parser.add_argument(
-        "-d",
-        "--duh-document",
-        help="The path to the DUH document",
-        required=True
-    )
+def load_json5(f_name: t.Union[str, Path], use_cache: bool = False) -> JSONType:
+    """
+    Load a JSON5 document.
 
-    parser.add_argument(
-        "--vendor",
-        help="The vendor name",
-        required=True,
-    )
+    The document is first parsed as plain JSON, which is much faster, and
+    only parsed as JSON5 when it is not valid JSON.
 
-    parser.add_argument(
-        "-D",
-        "--device",
-        help="The device name",
-        required=True,
-    )
+    :param f_name: the path to the document
+    :param use_cache: If True, keep the result of parsing a document as
+        JSON5 in a plain JSON file next to it, which later loads read
+        instead as long as the document is unchanged.
+    :return: the parsed document
+    """
+    f_name = Path(f_name)
+    cache_path = _json5_cache_path(f_name)
+    stat = f_name.stat()
 
-    parser.add_argument(
-        "-m",
-        "--metal-dir",
-        help="The path to the drivers/metal directory",
-        type=Path,
-        required=True,
-    )
+    cached = None
+    if use_cache:
+        try:
+            cached = json.loads(cache_path.read_bytes())
+        except (OSError, ValueError):
+            pass
+        if not isinstance(cached, dict):
+            cached = None
+        elif (cached.get('mtime_ns'), cached.get('size')) == \
+                (stat.st_mtime_ns, stat.st_size):
+            profiling.count('json5_cache_hits')
+            return cached['document']
+
+    source = f_name.read_bytes()
+    try:
+        with profiling.phase('decode_json'):
+            return json.loads(source)
+    except ValueError:
+        pass
+
+    # A touched but unchanged document still matches its hash, and only
+    # needs its cache entry refreshed.
+    digest = hashlib.sha256(source).hexdigest()
+    if cached is not None and cached.get('sha256') == digest:
+        profiling.count('json5_cache_hits')
+        document = cached['document']
+    else:
+        # json5 is slow to import as well as to parse with, so only pay for
+        # it when a document needs it.
+        import json5
+        profiling.count('json5_documents_parsed')
+        with profiling.phase('decode_json5'):
+            document = json5.loads(source.decode())
+
+    if use_cache:
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=str(f_name.parent),
+                                            prefix=cache_path.name)
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({
+                    'mtime_ns': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'sha256': digest,
+                    'document': document,
+                }, fp)
+            os.replace(tmp_path, str(cache_path))
+        except OSError:
+            # The cache is only an optimization, e.g. for read-only sources.
+            pass
+
+    return document
+
+
+class RefResolver:
+    """
+    Resolves the JSON references ($ref) of DUH documents into plain
+    dict/list trees.
 
-    parser.add_argument(
-        "-x",
-        "--overwrite-existing",
-        action="store_true",
-        default=False,
-        help="overwrite existing files"
-    )
+    Each referenced document is loaded once, and each referenced value is
+    resolved once, however many times it is referenced, so bundles of
+    documents sharing common definitions are loaded in linear time. The
+    resolved values are shared between all the places referencing them.
 
-    parser.add_argument(
-        "--always-include-address-block-in-macros",
-        action="store_true",
-        default=False,
-        help=(
-            "If set, always include the address block name in the C macro "
-            " names. By default, the address block name is only included when "
-            "there are multiple address blocks in order to preserve the "
-            "legacy C macro names generated for the single-address block case."
-        )
-    )
+    Relative references are resolved against the document containing them,
+    and fragments are JSON pointers (RFC 6901) into the referenced document.
+    """
 
-    return parser.parse_args()
+    def __init__(self, use_json5_cache: bool = False):
+        """
+        :param use_json5_cache: passed on to load_json5 for every local
+            document
+        """
+        self.use_json5_cache = use_json5_cache
+        self._documents: t.Dict[str, JSONType] = {}
+        self._resolved: t.Dict[t.Tuple[str, str], JSONType] = {}
+        self._resolving: t.Set[t.Tuple[str, str]] = set()
+
+    @property
+    def documents(self) -> t.List[str]:
+        """:return: the URIs of every document loaded so far"""
+        return list(self._documents)
+
+    @staticmethod
+    def _normalize(uri: str) -> str:
+        if urlparse(uri).netloc:
+            return uri
+        return os.path.normpath(uri)
+
+    def _document(self, uri: str) -> JSONType:
+        document = self._documents.get(uri)
+        if document is None:
+            profiling.count('ref_documents_loaded')
+            with profiling.phase('load_ref_document'):
+                if urlparse(uri).netloc:
+                    # Only needed for the rare remote references.
+                    import jsonref
+                    document = jsonref.jsonloader(uri)
+                else:
+                    document = load_json5(uri, self.use_json5_cache)
+            self._documents[uri] = document
+        return document
+
+    def resolve(self, uri: str, pointer: str = '') -> JSONType:
+        """
+        :param uri: the URI or path of a document
+        :param pointer: a JSON pointer into the document
+        :return: the value pointed to, with every reference inside it
+            resolved
+        """
+        key = (self._normalize(uri), pointer)
+        if key in self._resolved:
+            return self._resolved[key]
+        if key in self._resolving:
+            raise Exception(f"Circular $ref to {key[0]}#{pointer}")
+
+        self._resolving.add(key)
+        try:
+            value, resolved = self._follow(key[0], pointer)
+            if not resolved:
+                value = self._materialize(key[0], value)
+        finally:
+            self._resolving.discard(key)
+
+        self._resolved[key] = value
+        return value
+
+    def _resolve_ref(self, base_uri: str, ref: str) -> JSONType:
+        uri, fragment = urldefrag(urljoin(base_uri, ref))
+        return self.resolve(uri or base_uri, unquote(fragment))
+
+    def _follow(self, uri: str, pointer: str) -> t.Tuple[JSONType, bool]:
+        """
+        Follow a JSON pointer into a document.
+
+        :return: the value pointed to, and whether it is already resolved,
+            which is the case when the pointer goes through a reference
+        """
+        if pointer and not pointer.startswith('/'):
+            raise Exception(f"Invalid JSON pointer in $ref to {uri}#{pointer}")
+
+        node = self._document(uri)
+        resolved = False
+        for token in pointer.split('/')[1:]:
+            if isinstance(node, dict) and isinstance(node.get('$ref'), str) \
+                    and not resolved:
+                node = self._resolve_ref(uri, node['$ref'])
+                resolved = True
+            token = token.replace('~1', '/').replace('~0', '~')
+            try:
+                if isinstance(node, list):
+                    node = node[int(token)]
+                else:
+                    node = node[token]
+            except (KeyError, IndexError, ValueError, TypeError):
+                raise Exception(f"Unresolvable $ref to {uri}#{pointer}")
+        return node, resolved
+
+    def _materialize(self, base_uri: str, node: JSONType) -> JSONType:
+        if isinstance(node, dict):
+            ref = node.get('$ref')
+            if isinstance(ref, str):
+                return self._resolve_ref(base_uri, ref)
+            return {key: self._materialize(base_uri, value)
+                    for key, value in node.items()}
+        if isinstance(node, list):
+            return [self._materialize(base_uri, value) for value in node]
+        return node
+
+
+def load_json5_with_refs(f_name: str,
+                         resolver: t.Optional[RefResolver] = None) -> JSONType:
+    """
+    Load a DUH document, resolving its references.
 
+    :param f_name: the path to the document
+    :param resolver: the resolver to use, to share the documents it has
+        already loaded. A new one is used by default.
+    :return: the document, as a plain dict/list tree
+    """
+    if resolver is None:
+        resolver = RefResolver()
+    with profiling.phase('resolve_refs'):
+        return resolver.resolve(f_name)
 
-def main():
-    args = handle_args()
 
-    vendor = args.vendor
-    device = args.device
-    m_dir_path = args.metal_dir
-    overwrite_existing = args.overwrite_existing
-    always_include_address_block = args.always_include_address_block_in_macros
+# ###
+# Library API
+# ###
 
-    duh_info = load_json5_with_refs(args.duh_document)
+def find_registers(duh_info: JSONType) -> t.List[Register]:
+    """
+    Find the registers described by a DUH document.
 
+    :param duh_info: the parsed DUH document, with references resolved
+    :return: the list of registers in the document
+    """
     # ###
     # process pSchema (in duh document) to create symbol table
     # ###
@@ -611,12 +1503,17 @@ def main():
         offset = a_reg['addressOffset']
         width = a_reg['size']
         fields = a_reg.get('fields', [])
+        access = a_reg.get('access', 'read-write')
+        reset_value = a_reg.get('resetValue', 0)
         if isinstance(offset, str):
             offset = duh_symbol_table[offset]['default']
         if isinstance(width, str):
             width = duh_symbol_table[width]['default']
+        if isinstance(reset_value, str):
+            reset_value = duh_symbol_table[reset_value]['default']
         interpreted_fields = [interpret_register_field(field) for field in fields]
-        return Register.make_register(name, offset, width, interpreted_fields, address_block)
+        return Register.make_register(name, offset, width, interpreted_fields,
+                                      address_block, access, reset_value)
 
     def interpret_address_block(duh_addr_block: dict) -> AddressBlock:
         return AddressBlock(
@@ -626,13 +1523,53 @@ def main():
             width=duh_addr_block['width'],
         )
 
-    reglist: t.List[Register] = [
+    return [
         interpret_register(register, interpret_address_block(address_block))
         for memory_map in duh_info['component'].get('memoryMaps', [])
         for address_block in memory_map['addressBlocks']
         for register in address_block.get('registers', [])
     ]
 
+
+def driver_paths(vendor: str, device: str) -> t.Tuple[str, str]:
+    """
+    :return: the paths of the driver source file and header of a device,
+        relative to the drivers/metal directory
+    """
+    return f'{vendor}_{device}.c', f'{device}/{vendor}_{device}{0}.h'
+
+
+def find_field_accessors(duh_info: t.Union[JSONType, str, Path],
+                         device: str,
+                         always_include_address_block: bool = False,
+                         resolver: t.Optional[RefResolver] = None,
+                         shadow_write_only: bool = False,
+                         shadow_registers: t.Collection[str] = ()) \
+        -> t.List[FieldAccessor]:
+    """
+    Find the register fields described by a DUH document, and the names of
+    their accessors.
+
+    :param duh_info: the parsed DUH document, or the path to it
+    :param device: the device name
+    :param always_include_address_block: If True, always include the
+        address block name in the C macros and function prototypes.
+    :param resolver: the resolver loading the DUH document, if given as a
+        path
+    :param shadow_write_only: If True, shadow the write-only registers
+    :param shadow_registers: the names of other registers to shadow
+    :return: the accessors of every register field of the device
+    """
+    if isinstance(duh_info, (str, Path)):
+        with profiling.phase('load_duh'):
+            duh_info = load_json5_with_refs(str(duh_info), resolver)
+
+    with profiling.phase('extract_registers'):
+        reglist = find_registers(duh_info)
+    profiling.count('registers', len(reglist))
+    profiling.count('register_fields',
+                    sum(len(register.fields) for register in reglist))
+
     # When multiple address blocks are present, include the address block name
     # in the C macros in order to distinguish between registers in different
     # address blocks.
@@ -646,32 +1583,373 @@ def main():
     else:
         include_address_block = False
 
-    m_hdr_path = m_dir_path / device
-    m_hdr_path.mkdir(exist_ok=True, parents=True)
-
-    driver_file_path = m_dir_path / f'{vendor}_{device}.c'
-    header_file_path = m_hdr_path / f'{vendor}_{device}{0}.h'
-
-    if overwrite_existing or not driver_file_path.exists():
-        driver_file_path.write_text(
-            generate_metal_dev_drv(
-                vendor,
-                device,
-                0,
-                reglist,
-                include_address_block=include_address_block,
-            )
+    return make_field_accessors(device, reglist, include_address_block,
+                                shadow_write_only, shadow_registers)
+
+
+def generate_metal_drivers(duh_info: t.Union[JSONType, str, Path],
+                           vendor: str,
+                           device: str,
+                           always_include_address_block: bool = False,
+                           resolver: t.Optional[RefResolver] = None,
+                           accessor_mode: str = 'vtable',
+                           shadow_write_only: bool = False,
+                           shadow_registers: t.Collection[str] = (),
+                           driver_style: str = 'vtable') \
+        -> t.Dict[str, str]:
+    """
+    Generate the metal driver of a device.
+
+    :param duh_info: the parsed DUH document, or the path to it
+    :param vendor: the vendor name
+    :param device: the device name
+    :param always_include_address_block: If True, always include the
+        address block name in the C macros and function prototypes.
+    :param resolver: the resolver loading the DUH document, if given as a
+        path
+    :param accessor_mode: 'vtable' for the vtable-based API only, or
+        'inline' to also define static inline accessors in the header
+    :param shadow_write_only: If True, shadow the write-only registers
+    :param shadow_registers: the names of other registers to shadow
+    :param driver_style: 'vtable' for functions per register field, or
+        'table' for generic accessors and a table of the fields
+    :return: a mapping from the path of each generated file, relative to the
+        drivers/metal directory, to its contents
+    """
+    generate_driver, generate_header = driver_generators(
+        driver_style, accessor_mode,
+        shadow=shadow_write_only or bool(shadow_registers))
+    accessors = find_field_accessors(duh_info, device,
+                                     always_include_address_block, resolver,
+                                     shadow_write_only, shadow_registers)
+    driver_path, header_path = driver_paths(vendor, device)
+    return {
+        driver_path: generate_driver(vendor, device, 0, accessors),
+        header_path: generate_header(vendor, device, 0, accessors),
+    }
+
+
+def driver_generators(driver_style: str, accessor_mode: str,
+                      shadow: bool) -> t.Tuple[t.Callable, t.Callable]:
+    """
+    :param driver_style: 'vtable' or 'table'
+    :param accessor_mode: 'vtable' or 'inline'
+    :param shadow: True if any register may be shadowed
+    :return: the functions generating the .c and the .h file of a driver
+    """
+    if driver_style == 'table':
+        if accessor_mode != 'vtable' or shadow:
+            raise Exception("Table-driven drivers support neither inline "
+                            "accessors nor shadow registers")
+        return generate_metal_dev_table_drv, generate_metal_dev_table_hdr
+    return generate_metal_dev_drv, functools.partial(
+        generate_metal_dev_hdr, inline_accessors=accessor_mode == 'inline')
+
+
+# ###
+# Parallel generation
+# ###
+
+# (vendor, device, field accessors, (path, generate function) of each driver
+# file to write)
+DriverTask = t.Tuple[str, str, t.List[FieldAccessor],
+                     t.List[t.Tuple[Path, t.Callable]]]
+
+
+def write_driver_task(task: DriverTask) -> t.List[int]:
+    """
+    Write the driver files of a device.
+
+    :return: the size of each file written
+    """
+    vendor, device, accessors, files = task
+
+    sizes = []
+    for file_path, generate in files:
+        file_path.parent.mkdir(exist_ok=True, parents=True)
+        with streaming.atomic_output(file_path) as fp:
+            generate(vendor, device, 0, accessors, out=fp)
+            sizes.append(fp.tell())
+    return sizes
+
+
+def run_driver_tasks(tasks: t.List[DriverTask],
+                     jobs: int) -> t.List[t.List[int]]:
+    """
+    Run driver tasks, in parallel over a pool of jobs forked processes if
+    jobs is more than one and the platform can fork.
+
+    :return: the results, in the same order as the tasks
+    """
+    if jobs > 1 and len(tasks) > 1 and \
+            'fork' in multiprocessing.get_all_start_methods():
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(tasks)),
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            return list(executor.map(write_driver_task, tasks))
+
+    return [write_driver_task(task) for task in tasks]
+
+
+###
+# main
+###
+
+
+def handle_args(argv: t.Optional[t.List[str]] = None):
+    """
+    :param argv: the command line arguments, defaulting to sys.argv[1:]
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-d",
+        "--duh-document",
+        help="The path to the DUH document. May be repeated, once per "
+             "--device, to generate several drivers in one run.",
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--vendor",
+        help="The vendor name. Either given once, applying to every device, "
+             "or once per --device.",
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "-D",
+        "--device",
+        help="The device name. May be repeated, once per --duh-document.",
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--manifest",
+        help="The path to a JSON file containing a list of "
+             "{\"duh_document\": ..., \"vendor\": ..., \"device\": ...} "
+             "objects to generate drivers for, in addition to any given on "
+             "the command line. Relative DUH document paths are relative to "
+             "the manifest.",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "-m",
+        "--metal-dir",
+        help="The path to the drivers/metal directory",
+        type=Path,
+        required=True,
+    )
+
+    parser.add_argument(
+        "-x",
+        "--overwrite-existing",
+        action="store_true",
+        default=False,
+        help="overwrite existing files"
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="The number of processes writing drivers in parallel. DUH "
+             "documents are always loaded by the main process, so that "
+             "documents referenced by several of them are loaded once "
+             "(default: %(default)s)",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--always-include-address-block-in-macros",
+        action="store_true",
+        default=False,
+        help=(
+            "If set, always include the address block name in the C macro "
+            " names. By default, the address block name is only included when "
+            "there are multiple address blocks in order to preserve the "
+            "legacy C macro names generated for the single-address block case."
         )
-    else:
-        print(f"{str(driver_file_path)} exists, not creating.",
-              file=sys.stderr)
+    )
 
-    if overwrite_existing or not header_file_path.exists():
-        header_file_path.write_text(
-            generate_metal_dev_hdr(vendor, device, 0, reglist, include_address_block))
-    else:
-        print(f"{str(header_file_path)} exists, not creating.",
-              file=sys.stderr)
+    parser.add_argument(
+        "--accessors",
+        help="The register field accessors to generate. 'vtable' generates "
+             "the metal_<device>_<register>_<field>_read/write functions, "
+             "which call through the vtable of each instance. 'inline' also "
+             "defines static inline <device>_<register>_<field>_read/"
+             "write_inline functions in the header, which take the base "
+             "address of an instance and compile down to a load and a mask "
+             "(default: %(default)s)",
+        choices=['vtable', 'inline'],
+        default='vtable',
+    )
+
+    parser.add_argument(
+        "--driver-style",
+        help="The style of the drivers. 'vtable' generates read and write "
+             "functions for every register field. 'table' generates a const "
+             "table describing the register fields, and generic "
+             "metal_<device>_field_read/write functions indexed by an enum of "
+             "the fields, so that the size of the driver hardly depends on "
+             "the number of fields. 'table' supports neither "
+             "--accessors=inline nor shadow registers "
+             "(default: %(default)s)",
+        choices=['vtable', 'table'],
+        default='vtable',
+    )
+
+    parser.add_argument(
+        "--shadow-write-only",
+        action="store_true",
+        default=False,
+        help="Keep a copy in RAM of every register whose DUH access is "
+             "write-only or writeOnce, so that writing its fields never "
+             "reads it from the hardware, and reading it returns the value "
+             "last written",
+    )
+
+    parser.add_argument(
+        "--shadow-register",
+        help="The name of a register to keep a copy of in RAM, like with "
+             "--shadow-write-only, e.g. because only software changes it. "
+             "Either the plain name, or <address block>.<register>. May be "
+             "repeated. Every name must be a register of every device "
+             "generated.",
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--json5-cache",
+        action="store_true",
+        default=False,
+        help="Keep the result of parsing each JSON5 (as opposed to plain "
+             "JSON) document in a hidden .json-cache file next to it, so "
+             "that later runs skip the slow JSON5 parser while the document "
+             "is unchanged",
+    )
+
+    incremental.add_arguments(parser)
+    profiling.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    duh_documents = args.duh_document
+    vendors = args.vendor
+    devices = args.device
+    if len(duh_documents) != len(devices):
+        parser.error("--duh-document and --device must be given the same "
+                     "number of times")
+    if len(vendors) > 1 and len(vendors) != len(devices):
+        parser.error("--vendor must be given either once or once per --device")
+    if devices and not vendors:
+        parser.error("--vendor is required with --device")
+    if len(vendors) == 1:
+        vendors = vendors * len(devices)
+    args.targets = list(zip(duh_documents, vendors, devices))
+
+    if args.manifest:
+        for entry in json.loads(args.manifest.read_text()):
+            args.targets.append((
+                str(args.manifest.parent / entry['duh_document']),
+                entry['vendor'],
+                entry['device'],
+            ))
+
+    if not args.targets:
+        parser.error("at least one --duh-document and --device, or a "
+                     "--manifest, is required")
+
+    if args.driver_style == 'table':
+        if args.accessors != 'vtable':
+            parser.error("--driver-style=table does not support "
+                         "--accessors=inline")
+        if args.shadow_write_only or args.shadow_register:
+            parser.error("--driver-style=table does not support "
+                         "--shadow-write-only or --shadow-register")
+
+    return args
+
+
+def main(argv: t.Optional[t.List[str]] = None):
+    args = handle_args(argv)
+    with profiling.Profiler('generate_drivers', args.profile_report,
+                            args.profile_cprofile):
+        return run(args)
+
+
+def run(args: argparse.Namespace) -> int:
+    """
+    Generate the metal drivers requested on the command line.
+
+    :param args: the parsed command line arguments
+    :return: the exit status
+    """
+    m_dir_path = args.metal_dir
+    overwrite_existing = args.overwrite_existing
+
+    options = incremental.hash_options(args)
+    version = incremental.source_version(__file__, streaming.__file__)
+    manifest_path = args.dependency_manifest
+    if args.incremental:
+        overwrite_existing = True
+        if manifest_path is None:
+            manifest_path = incremental.default_manifest_path(
+                m_dir_path, 'generate_drivers', options)
+        previous = incremental.DependencyManifest.load(manifest_path)
+        if previous is not None and \
+                previous.is_up_to_date('generate_drivers', version, options):
+            return 0
+
+    # One resolver for the whole run, so that files referenced by several
+    # DUH documents are only loaded once.
+    resolver = RefResolver(use_json5_cache=args.json5_cache)
+    generate_driver, generate_header = driver_generators(
+        args.driver_style, args.accessors,
+        shadow=args.shadow_write_only or bool(args.shadow_register))
+    tasks: t.List[DriverTask] = []
+    output_paths: t.List[Path] = []
+    for duh_document, vendor, device in args.targets:
+        accessors = find_field_accessors(
+            duh_document,
+            device,
+            always_include_address_block=args.always_include_address_block_in_macros,
+            resolver=resolver,
+            shadow_write_only=args.shadow_write_only,
+            shadow_registers=args.shadow_register,
+        )
+
+        driver_path, header_path = driver_paths(vendor, device)
+        files = []
+        for path, generate in ((driver_path, generate_driver),
+                               (header_path, generate_header)):
+            file_path = m_dir_path / path
+            output_paths.append(file_path)
+            if overwrite_existing or not file_path.exists():
+                files.append((file_path, generate))
+            else:
+                print(f"{str(file_path)} exists, not creating.",
+                      file=sys.stderr)
+        if files:
+            tasks.append((vendor, device, accessors, files))
+
+    with profiling.phase('write_files'):
+        for sizes in run_driver_tasks(tasks, args.jobs):
+            profiling.count('files_written', len(sizes))
+            profiling.count('bytes_written', sum(sizes))
+
+    if manifest_path is not None:
+        incremental.DependencyManifest.record(
+            'generate_drivers', version, options,
+            inputs=resolver.documents,
+            outputs=output_paths,
+        ).write(manifest_path)
 
     return 0
 
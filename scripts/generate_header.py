@@ -1,20 +1,33 @@
 #!/usr/bin/env python3.7
 
 import argparse
+import bisect
+import concurrent.futures
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import marshal
+import multiprocessing
+import os
+import re
 import string
 import sys
+import tempfile
 import textwrap
 import typing as t
 from dataclasses import dataclass
 from pathlib import Path
 from collections import Counter
 
+import incremental
+import profiling
+import streaming
+
 PlainJSONType = t.Union[dict, list, t.AnyStr, float, bool]
 JSONType = t.Union[PlainJSONType, t.Iterator[PlainJSONType]]
 
-NAME_COLLISION_DICT = Counter()
-
 # Json utility
 
 
@@ -36,6 +49,211 @@ def walk(j_obj: JSONType) -> t.Iterator[JSONType]:
             yield from walk(j)
 
 
+class ObjectModelIndex:
+    """
+    Index of the typed nodes (objects with a _types entry) of a parsed object
+    model, built with a single traversal.
+
+    Nodes are numbered in the order walk() would visit them. Along with the
+    number one past the last node in its subtree, this turns "all nodes of
+    type X below node Y" into a pair of bisections of the sorted positions
+    of type X.
+    """
+
+    def __init__(self, object_model: JSONType):
+        self._nodes: t.List[dict] = []
+        self._subtree_end: t.List[int] = []
+        self._positions: t.Dict[int, int] = {}
+        self._by_type: t.Dict[str, t.List[int]] = {}
+        self._by_suffix: t.Dict[str, t.List[int]] = {}
+
+        stack = [(object_model, False)]
+        while stack:
+            node, exiting = stack.pop()
+            if exiting:
+                self._subtree_end[node] = len(self._nodes)
+                continue
+
+            if isinstance(node, dict):
+                if '_types' in node:
+                    position = len(self._nodes)
+                    self._nodes.append(node)
+                    self._subtree_end.append(position + 1)
+                    self._positions[id(node)] = position
+                    for a_type in dict.fromkeys(node['_types']):
+                        self._by_type.setdefault(a_type, []).append(position)
+                    stack.append((position, True))
+                children = list(node.values())
+            elif isinstance(node, list):
+                children = node
+            else:
+                continue
+
+            for child in reversed(children):
+                if isinstance(child, (dict, list)):
+                    stack.append((child, False))
+
+    def _span(self, root: t.Optional[dict]) -> t.Tuple[int, int]:
+        if root is None:
+            return 0, len(self._nodes)
+        position = self._positions[id(root)]
+        return position, self._subtree_end[position]
+
+    def _select(self, positions: t.List[int],
+                root: t.Optional[dict]) -> t.List[dict]:
+        start, end = self._span(root)
+        lo = bisect.bisect_left(positions, start)
+        hi = bisect.bisect_left(positions, end, lo)
+        return [self._nodes[i] for i in positions[lo:hi]]
+
+    def _suffix_positions(self, suffix: str) -> t.List[int]:
+        suffix = suffix.lower()
+        if suffix not in self._by_suffix:
+            matching = [positions for a_type, positions in self._by_type.items()
+                        if a_type.lower().endswith(suffix)]
+            self._by_suffix[suffix] = [
+                position for position, _ in
+                itertools.groupby(heapq.merge(*matching))
+            ]
+        return self._by_suffix[suffix]
+
+    def nodes_of_type(self, om_type: str,
+                      root: t.Optional[dict] = None) -> t.List[dict]:
+        """
+        :param om_type: a type name, as it appears in _types
+        :param root: if given, only return nodes in the subtree of this
+            indexed node, including the node itself
+        :return: the nodes having om_type in their _types, in walk() order
+        """
+        return self._select(self._by_type.get(om_type, []), root)
+
+    def nodes_with_type_suffix(self, suffix: str,
+                               root: t.Optional[dict] = None) -> t.List[dict]:
+        """
+        :param suffix: the case-insensitive suffix to look for
+        :param root: if given, only return nodes in the subtree of this
+            indexed node, including the node itself
+        :return: the nodes having a type ending with suffix, in walk() order
+        """
+        return self._select(self._suffix_positions(suffix), root)
+
+    def __len__(self) -> int:
+        """:return: the number of typed nodes in the object model"""
+        return len(self._nodes)
+
+
+# Matches, in a chunk of JSON text, a complete string, a bracket, or the
+# opening quote of a string which continues into the next chunk.
+_OM_TOKEN_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]|"', re.DOTALL)
+_OM_WHITESPACE_RE = re.compile(rb'[ \t\n\r]*')
+_OM_TYPES_KEY = b'"_types"'
+
+
+def scan_object_model(fp: t.BinaryIO,
+                      keep: t.Callable[[t.List[str]], bool],
+                      chunk_size: int = 1 << 20) -> t.List[t.Tuple[int, int]]:
+    """
+    Scan a JSON object model without decoding it, returning the byte spans of
+    the outermost objects whose _types are accepted by keep.
+
+    Only the nesting of the document and the _types arrays are tracked, so
+    memory use is bounded by the chunk size and the depth of the document.
+
+    :param fp: the object model, opened in binary mode
+    :param keep: predicate called with the _types of every typed object
+    :param chunk_size: the number of bytes read at a time
+    :return: (start, end) byte offsets of the kept objects, in document order
+    """
+    spans: t.List[t.Tuple[int, int]] = []
+    # One entry per open container: [start offset, kept] for objects, None
+    # for arrays.
+    stack: t.List[t.Optional[list]] = []
+    types: t.Optional[t.List[str]] = None
+    expect_types = False
+
+    buf = b''
+    buf_offset = 0
+    eof = False
+    while not eof:
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        consumed = len(buf)
+
+        for match in _OM_TOKEN_RE.finditer(buf):
+            token = match.group()
+            if expect_types and token != b'[':
+                expect_types = False
+
+            if token == b'"':
+                if eof:
+                    raise ValueError(f'Unterminated string at offset {buf_offset + match.start()}')
+                consumed = match.start()
+                break
+            elif token == b'{':
+                stack.append([buf_offset + match.start(), False])
+            elif token == b'[':
+                stack.append(None)
+                if expect_types:
+                    expect_types = False
+                    types = []
+            elif token == b'}':
+                start, kept = stack.pop()
+                if kept:
+                    # Anything kept since this object was opened is part of it.
+                    while spans and spans[-1][0] >= start:
+                        spans.pop()
+                    spans.append((start, buf_offset + match.end()))
+            elif token == b']':
+                stack.pop()
+                if types is not None:
+                    stack[-1][1] = keep(types)
+                    types = None
+            elif types is not None:
+                types.append(json.loads(token))
+            elif token == _OM_TYPES_KEY:
+                separator = _OM_WHITESPACE_RE.match(buf, match.end()).end()
+                if separator == len(buf) and not eof:
+                    consumed = match.start()
+                    break
+                expect_types = buf[separator:separator + 1] == b':'
+
+        buf_offset += consumed
+        buf = buf[consumed:]
+
+    return spans
+
+
+def load_object_model(f_name: str,
+                      keep: t.Optional[t.Callable[[t.List[str]], bool]] = None) \
+        -> JSONType:
+    """
+    Load an object model.
+
+    If keep is given, the object model is streamed and only the objects whose
+    _types are accepted by keep are decoded, along with everything they
+    contain. They are returned as a list, in document order, which can be
+    queried in the same way as the full object model for anything inside the
+    kept objects. Peak memory then follows the size of the kept objects
+    rather than the size of the whole file.
+
+    :param f_name: the path to the object model
+    :param keep: predicate called with the _types of every typed object
+    :return: the parsed object model
+    """
+    if keep is None:
+        with open(f_name) as fp:
+            return json.load(fp)
+
+    with open(f_name, 'rb') as fp:
+        spans = scan_object_model(fp, keep)
+        kept = []
+        for start, end in spans:
+            fp.seek(start)
+            kept.append(json.loads(fp.read(end - start)))
+        return kept
+
+
 @dataclass(frozen=True)
 class AddressBlock:
     """Describes an OMAddressBlock."""
@@ -43,6 +261,8 @@ class AddressBlock:
     baseAddress: int
     range: int
     width: int
+    # Index of the parent memory region in DeviceBase.base_addresses.
+    region: int = 0
 
 # Data Classes
 # we pull RegisterFields, Interrupts, and Devices from the Object Model.
@@ -53,56 +273,91 @@ class RegisterField:
     """
     data class to hold information about a register field.
     """
+    __slots__ = ('name', 'offset', 'width', 'regFieldGroup', 'addressBlock',
+                 'resetValue')
     name: str
     offset: int  # in bits
     width: int  # in bits
     regFieldGroup: str
     addressBlock: str  # Empty string if not set.
-    all_registers: t.ClassVar = {}
+    resetValue: t.Optional[int]  # None if not known.
+
+
+@dataclass(frozen=True)
+class Interrupt:
+    """
+    Data class to hold information about an interrupt. May be
+    unnamed, in which case the name is and empty string.
+    """
+    __slots__ = ('number', 'name')
+    number: int
+    name: str
+
+
+class GenerationContext:
+    """
+    The tables used while generating the header of one device.
+
+    Register fields and interrupts are deduplicated by name, and the C macro
+    names emitted are counted to detect collisions. A context should be
+    dropped once its device is done, so that unrelated devices never
+    collide with each other and the tables do not outlive their use.
+    """
+    __slots__ = ('registers', 'interrupts', 'name_collisions')
+
+    def __init__(self):
+        self.registers: t.Dict[t.Tuple[str, str, str], RegisterField] = {}
+        self.interrupts: t.Dict[str, Interrupt] = {}
+        self.name_collisions: t.Counter[str] = Counter()
 
-    @staticmethod
     def make_register(
+        self,
         name: str,
         offset: int,
         width: int,
         group: str,
         addressBlock: t.Optional[str] = '',
-    ) -> "RegisterField":
-        addressBlock = addressBlock or ''
+        resetValue: t.Optional[int] = None,
+    ) -> RegisterField:
+        name = sys.intern(name)
+        group = sys.intern(group)
+        addressBlock = sys.intern(addressBlock or '')
         key = (name, group, addressBlock)
-        if name != 'reserved' and key in RegisterField.all_registers:
-            old_field = RegisterField.all_registers[key]
-            new_field = RegisterField(name, offset, width, group, addressBlock)
+        if name != 'reserved' and key in self.registers:
+            old_field = self.registers[key]
+            new_field = RegisterField(name, offset, width, group, addressBlock,
+                                      resetValue)
             if old_field != new_field:
                 raise Exception(f'Found two register fields with the name but different values: {old_field} != {new_field}')
             else:
-                return RegisterField.all_registers[key]
-
-        RegisterField.all_registers[key] = RegisterField(name, offset, width, group, addressBlock)
-        return RegisterField.all_registers[key]
+                return self.registers[key]
 
+        self.registers[key] = RegisterField(name, offset, width, group,
+                                            addressBlock, resetValue)
+        return self.registers[key]
 
-@dataclass(frozen=True)
-class Interrupt:
-    """
-    Data class to hold information about an interrupt. May be
-    unnamed, in which case the name is and empty string.
-    """
-    number: int
-    name: str
-    all_interrupts: t.ClassVar = {}
-
-    @staticmethod
-    def make_interrupt(number, name=''):
-        if name and name in Interrupt.all_interrupts:
+    def make_interrupt(self, number: int, name: str = '') -> Interrupt:
+        name = sys.intern(name)
+        if name and name in self.interrupts:
             an_interrupt = Interrupt(number, name)
-            if Interrupt.all_interrupts[name] != an_interrupt:
+            if self.interrupts[name] != an_interrupt:
                 raise Exception(f"duplicate interrupt {name}")
             else:
-                return Interrupt.all_interrupts[name]
+                return self.interrupts[name]
 
-        Interrupt.all_interrupts[name] = Interrupt(number, name)
-        return Interrupt.all_interrupts[name]
+        self.interrupts[name] = Interrupt(number, name)
+        return self.interrupts[name]
+
+    def report_name_collisions(self, file: t.Optional[t.TextIO] = None) -> None:
+        """
+        :param file: where to report the collisions, defaulting to the
+            current sys.stderr
+        """
+        if file is None:
+            file = sys.stderr
+        for k, v in self.name_collisions.items():
+            if v > 1:
+                print(f'Variable {k} repeated', file=file)
 
 
 @dataclass(frozen=True)
@@ -156,6 +411,14 @@ METAL_BASE_HDR_TMPL = \
 
     #define ${capitalized_device}_BASES {${base_address}}
 
+    // ${capitalized_device}_BASES_FOREACH(X) expands to X(base) for the base
+    // address of each instance of this device in turn, for building static
+    // tables at compile time, e.g.
+    // #define BASE_POINTER(base) (uint32_t *)(uintptr_t)(base),
+    // uint32_t *const bases[${capitalized_device}_COUNT] = { ${capitalized_device}_BASES_FOREACH(BASE_POINTER) };
+
+    #define ${capitalized_device}_BASES_FOREACH(X) ${base_address_foreach}
+
     // Base addresses of each memory region of each instance of this device.
     ${base_addresses}
 
@@ -164,6 +427,18 @@ METAL_BASE_HDR_TMPL = \
 
     ${address_blocks}
 
+    // Base addresses and interrupts of each instance of this device, for
+    // code using a fixed instance:
+    // ${capitalized_device}_<N>_BASE => base address of the first memory region
+    // ${capitalized_device}_<N>_<REGION>_BASE => base address of a memory region
+    // ${capitalized_device}_<N>_ADDRESS_BLOCK_<NAME>_BASE => base address of an
+    //   address block
+    // ${capitalized_device}_<N>_INTERRUPT_BASE => lowest absolute interrupt number
+    // ${capitalized_device}_<N>_INTERRUPT_<NAME> => absolute interrupt number,
+    //   named after its position among the interrupts of the device if unnamed
+
+    ${instances}
+
     // : these macros have control_base as a hidden input
     // use with the _BYTE #define's
     #define METAL_${capitalized_device}_REG(offset) ((unsigned long)control_base + (offset))
@@ -177,12 +452,45 @@ METAL_BASE_HDR_TMPL = \
     // METAL_NAME_BYTE => (uint8_t *) offset from base
     // METAL_NAME_BIT => number of bits into METAL_NAME_BYTE
     // METAL_NAME_WIDTH => bit width
+    // METAL_NAME_REG_OFFSET => byte offset from base of the register
+    //   holding the field
+    // METAL_NAME_SHIFT => number of bits into that register
+    // METAL_NAME_MASK => mask of the field in that register
 
     ${register_offsets}
 
+    // Registers, named after the group of their fields, which fit in one
+    // aligned 32 or 64-bit word.
+    // METAL_GROUP_WIDTH => bit width of the register
+    // METAL_GROUP_RESET => reset value of the register, if known
+
+    ${register_values}
+
+    #endif
+    """
+
+# This is the template of the memory map of the whole SOC, generated along
+# with the base headers of every device.
+
+SOC_MEMORY_MAP_HDR_TMPL = \
+    """
+    #ifndef soc_memory_map_h
+    #define soc_memory_map_h
+
+    // Base addresses of each instance of every device of the SOC:
+    // SOC_MEMORY_MAP_<DEVICE>_COUNT => number of instances of the device
+    // SOC_MEMORY_MAP_<DEVICE>_<N>_BASE => base address of the first memory
+    //   region of an instance
+    // SOC_MEMORY_MAP_<DEVICE>_<N>_<REGION>_BASE => base address of a memory
+    //   region of an instance
+
+    ${devices}
+
     #endif
     """
 
+SOC_MEMORY_MAP_PATH = 'soc_memory_map.h'
+
 
 def _formatted_for_c_macro(s: str) -> str:
     """Format and sanitize a string for use in a C macro name."""
@@ -191,20 +499,64 @@ def _formatted_for_c_macro(s: str) -> str:
 
 # sub templates
 # generate sub parts of template
-def generate_offsets(device_name: str, dev_list: t.List[DeviceBase]) -> str:
+def _register_word(start: int, end: int) -> t.Optional[t.Tuple[int, int]]:
+    """
+    :param start: the bit offset of the first bit of a register
+    :param end: the bit offset past its last bit
+    :return: the bit offset and width of the smallest aligned 32 or 64-bit
+        word holding the bits, or None if there is none
+    """
+    for width in (32, 64):
+        base = start - start % width
+        if end <= base + width:
+            return base, width
+    return None
+
+
+def find_register_words(register_fields: t.List[RegisterField]) \
+        -> t.Dict[t.Tuple[str, str], t.Optional[t.Tuple[int, int]]]:
+    """
+    :param register_fields: the register fields of a device
+    :return: the bit offset and width of the word holding each register,
+        keyed by address block and group, or None for the groups which do not
+        fit in one word
+    """
+    spans: t.Dict[t.Tuple[str, str], t.Tuple[int, int]] = {}
+    for a_reg in register_fields:
+        key = (a_reg.addressBlock, a_reg.regFieldGroup)
+        start, end = spans.get(key, (a_reg.offset, a_reg.offset))
+        spans[key] = (min(start, a_reg.offset),
+                      max(end, a_reg.offset + a_reg.width))
+    return {key: _register_word(*span) for key, span in spans.items()}
+
+
+def _c_literal(value: int, width: int) -> str:
+    """Format an unsigned value of a register of the given width for C."""
+    return hex(value) + ('ULL' if width > 32 else 'U')
+
+
+def generate_offsets(device_name: str, dev_list: t.List[DeviceBase],
+                     context: t.Optional[GenerationContext] = None) \
+        -> t.Iterator[str]:
     """
     Generate the register offset macros
 
     :param device_name: the name of the device
     :param dev_list: the list of devices for the SOC
-    :return:The offset c macros for the device and registers
+    :param context: the context in which to count macro name collisions
+    :return: an iterator of the offset c macros for the device and
+        registers, one register field at a time
     """
-    rv: t.List[str] = []
+    if context is None:
+        context = GenerationContext()
+    name_collisions = context.name_collisions
 
     capitalized_device = device_name.upper()
     if dev_list:
         # only need to check the first device
-        for a_reg in dev_list[0].register_fields:
+        register_fields = dev_list[0].register_fields
+        words = find_register_words(register_fields)
+        for a_reg in register_fields:
             if a_reg.name == 'reserved':
                 continue
             name = _formatted_for_c_macro(a_reg.name)
@@ -213,6 +565,11 @@ def generate_offsets(device_name: str, dev_list: t.List[DeviceBase]) -> str:
             offset = a_reg.offset
             width = a_reg.width
 
+            # Fields of groups which are not one register are accessed in
+            # the word holding the field alone.
+            word = words[(a_reg.addressBlock, a_reg.regFieldGroup)] or \
+                _register_word(offset, offset + width)
+
             # For legacy reasons, emit both a version of these macros with
             # and without the address block name.
             infix = ''
@@ -242,17 +599,91 @@ def generate_offsets(device_name: str, dev_list: t.List[DeviceBase]) -> str:
                 # All the conflicts are still printed out at the end of this
                 # script anyway, so the risk of this silently doing something
                 # surprising is low.
-                NAME_COLLISION_DICT[prefix] += 1
-                if prefix == legacy_prefix and NAME_COLLISION_DICT[prefix] > 1:
+                name_collisions[prefix] += 1
+                if prefix == legacy_prefix and name_collisions[prefix] > 1:
                     continue
                 macro_line =  f'#define {prefix} {offset}\n'
                 macro_line += f'#define {prefix}_BYTE {offset >> 3}\n'
                 macro_line += f'#define {prefix}_BIT {offset & 0x7}\n'
                 macro_line += f'#define {prefix}_WIDTH {width}\n'
+                if word:
+                    word_offset, word_width = word
+                    shift = offset - word_offset
+                    mask = ((1 << width) - 1) << shift
+                    macro_line += f'#define {prefix}_REG_OFFSET {word_offset >> 3}\n'
+                    macro_line += f'#define {prefix}_SHIFT {shift}\n'
+                    macro_line += f'#define {prefix}_MASK {_c_literal(mask, word_width)}\n'
 
-                rv.append(macro_line)
+                yield macro_line
 
-    return '\n'.join(rv)
+
+def generate_register_values(device_name: str, dev_list: t.List[DeviceBase],
+                             context: t.Optional[GenerationContext] = None) \
+        -> t.Iterator[str]:
+    """
+    Generate the width and reset value macros of the registers
+
+    Must be called after generate_offsets, so that the register macros
+    colliding with the register field macros are the ones left out.
+
+    :param device_name: the name of the device
+    :param dev_list: the list of devices for the SOC
+    :param context: the context in which to count macro name collisions
+    :return: an iterator of the c macros for the device, one register at a
+        time
+    """
+    if context is None:
+        context = GenerationContext()
+    name_collisions = context.name_collisions
+
+    capitalized_device = device_name.upper()
+    if not dev_list:
+        return
+
+    # only need to check the first device
+    register_fields = dev_list[0].register_fields
+    words = find_register_words(register_fields)
+    resets: t.Dict[t.Tuple[str, str], t.Optional[int]] = {
+        key: 0 for key, word in words.items() if word
+    }
+    for a_reg in register_fields:
+        key = (a_reg.addressBlock, a_reg.regFieldGroup)
+        if resets.get(key) is None:
+            continue
+        if a_reg.resetValue is None:
+            resets[key] = None
+            continue
+        field_reset = a_reg.resetValue & ((1 << a_reg.width) - 1)
+        resets[key] |= field_reset << (a_reg.offset - words[key][0])
+
+    for key, reset in resets.items():
+        _, width = words[key]
+        addressBlock = _formatted_for_c_macro(key[0])
+        group = _formatted_for_c_macro(key[1])
+        if not group:
+            continue
+
+        # As for the register fields, emit the macros both with and without
+        # the address block name, leaving out the colliding ones.
+        prefixes = [f'{capitalized_device}_REGISTER_{group}']
+        if addressBlock:
+            prefixes.append(
+                f'{capitalized_device}_REGISTER_{addressBlock}_{group}')
+
+        values = [('WIDTH', str(width))]
+        if reset is not None:
+            values.append(('RESET', _c_literal(reset, width)))
+
+        macro_line = ''
+        for prefix in prefixes:
+            for suffix, value in values:
+                name = f'{prefix}_{suffix}'
+                name_collisions[name] += 1
+                if name_collisions[name] > 1:
+                    continue
+                macro_line += f'#define {name} {value}\n'
+        if macro_line:
+            yield macro_line
 
 
 def generate_address_blocks(device_name: str, dev_list: t.List[DeviceBase]) -> str:
@@ -271,6 +702,51 @@ def generate_address_blocks(device_name: str, dev_list: t.List[DeviceBase]) -> s
         ])
     return '\n'.join(lines)
 
+def generate_instance_defines(device_name: str,
+                              dev_list: t.List[DeviceBase]) -> str:
+    """
+    Generate the base address and interrupt macros of each instance.
+
+    :param device_name: the name of the device
+    :param dev_list: the list of devices for the SOC
+    :return: A snippet of C that includes the macros.
+    """
+    device_macro = _formatted_for_c_macro(device_name)
+
+    # Interrupts are deduplicated by name, so the interrupts of the other
+    # instances are found at the same offset from their base. Unnamed
+    # interrupts, including those named after their device instance, are
+    # named after their position instead.
+    interrupt_offsets = [
+        (_formatted_for_c_macro(i.name) if i.name else str(k),
+         i.number - dev_list[0].base_interrupt)
+        for k, i in enumerate(dev_list[0].interrupts)
+    ]
+
+    blocks = []
+    for device in dev_list:
+        prefix = f"{device_macro}_{device.index}"
+        lines = [f"#define {prefix}_BASE {hex(device.base_address)}ULL"]
+        for region_name, base_address in device.base_addresses:
+            formatted_region_name = region_name.replace(" ", "_").upper()
+            lines.append(f"#define {prefix}_{formatted_region_name}_BASE "
+                         f"{hex(base_address)}ULL")
+        for address_block in device.address_blocks:
+            block_macro = _formatted_for_c_macro(address_block.name)
+            _, region_base = device.base_addresses[address_block.region]
+            base_address = region_base + address_block.baseAddress
+            lines.append(f"#define {prefix}_ADDRESS_BLOCK_{block_macro}_BASE "
+                         f"{hex(base_address)}ULL")
+        if device.base_interrupt is not None:
+            lines.append(f"#define {prefix}_INTERRUPT_BASE "
+                         f"{device.base_interrupt}")
+            for name, offset in interrupt_offsets:
+                lines.append(f"#define {prefix}_INTERRUPT_{name} "
+                             f"{device.base_interrupt + offset}")
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
 def generate_interrupt_defines(bases: t.List[DeviceBase],
                                device: str) -> str:
     """
@@ -344,83 +820,139 @@ def generate_base_addresses(device_name: str, dev_list: t.List[DeviceBase]) -> s
 
 def generate_base_hdr(vendor: str,
                       device: str,
-                      devlist: t.List[DeviceBase]):
+                      devlist: t.List[DeviceBase],
+                      context: t.Optional[GenerationContext] = None,
+                      out: t.Optional[t.TextIO] = None) -> t.Optional[str]:
     """
     Master function to generate the include file.
 
     :param vendor:  string of the vendor name
     :param device:  string of the device name
     :param devlist: list of devices
-    :return: a string for the header file
+    :param context: the context in which to count macro name collisions
+    :param out: if given, the stream to write the header file to as it is
+        generated
+    :return: a string for the header file, or None if written to out
     """
+    if out is None:
+        out = io.StringIO()
+        generate_base_hdr(vendor, device, devlist, context, out)
+        return out.getvalue()
+
     template = string.Template(textwrap.dedent(METAL_BASE_HDR_TMPL))
 
     base = ", ".join(hex(i.base_address) + 'ULL' for i in devlist)
+    base_foreach = " ".join(f"X({hex(i.base_address)}ULL)" for i in devlist)
 
     interrupts = generate_interrupt_defines(devlist, device)
 
-    return template.substitute(
+    streaming.write_template(out, template, dict(
         base_address=base,
+        base_address_foreach=base_foreach,
         base_addresses=generate_base_addresses(device_name=device, dev_list=devlist),
         dev_count=len(devlist),
         vendor=vendor,
         device=device,
         capitalized_device=device.upper(),
-        register_offsets=generate_offsets(device, devlist),
+        register_offsets=generate_offsets(device, devlist, context),
+        register_values=generate_register_values(device, devlist, context),
         interrupts=interrupts,
         address_blocks=generate_address_blocks(device, devlist),
-    )
+        instances=generate_instance_defines(device, devlist),
+    ))
+    return None
+
+
+def generate_soc_memory_map(devlists: t.Mapping[str, t.List[DeviceBase]],
+                            out: t.Optional[t.TextIO] = None) \
+        -> t.Optional[str]:
+    """
+    Generate the memory map of the SOC.
+
+    :param devlists: the instances of each device
+    :param out: if given, the stream to write the header file to as it is
+        generated
+    :return: a string for the header file, or None if written to out
+    """
+    if out is None:
+        out = io.StringIO()
+        generate_soc_memory_map(devlists, out)
+        return out.getvalue()
+
+    def generate_devices() -> t.Iterator[str]:
+        for device_name, dev_list in devlists.items():
+            device_macro = f"SOC_MEMORY_MAP_{_formatted_for_c_macro(device_name)}"
+            lines = [f"#define {device_macro}_COUNT {len(dev_list)}"]
+            for device in dev_list:
+                prefix = f"{device_macro}_{device.index}"
+                lines.append(f"#define {prefix}_BASE "
+                             f"{hex(device.base_address)}ULL")
+                for region_name, base_address in device.base_addresses:
+                    formatted_region_name = region_name.replace(" ", "_").upper()
+                    lines.append(f"#define {prefix}_{formatted_region_name}_BASE "
+                                 f"{hex(base_address)}ULL")
+            yield '\n'.join(lines) + '\n'
+
+    template = string.Template(textwrap.dedent(SOC_MEMORY_MAP_HDR_TMPL))
+    streaming.write_template(out, template, dict(devices=generate_devices()))
+    return None
 
 
 # parsing the OM file
 
-def find_interrupts(object_model: JSONType, device: str) \
+def find_interrupts(object_model: JSONType, device: str,
+                    index: t.Optional[ObjectModelIndex] = None,
+                    context: t.Optional[GenerationContext] = None) \
         -> t.List[Interrupt]:
     """
     given a parsed device, return the interrupts for the device
 
     :param object_model: a device parsed from the object model
     :param device: a string name of the device
+    :param index: an index of the object model containing the device. If
+        not given, the device is indexed on its own.
+    :param context: the context in which to deduplicate interrupts
     :return: a list of the interrupts
     """
+    if index is None:
+        index = ObjectModelIndex(object_model)
+    if context is None:
+        context = GenerationContext()
 
-    def type_match(dev: str, types: t.List[str]):
-        d_str = dev.lower()
-        for a_type in types:
-            if a_type.lower().endswith(d_str):
-                return True
-        return False
-
-    p = walk(object_model)
-    p = filter(lambda x: '_types' in x, p)
-    p = filter(lambda x: type_match(device, x['_types']), p)
-    p = list(p)
-
-    for dev_om in p:
-        p = walk(dev_om)
-        p = filter(lambda x: '_types' in x, p)
-        p = filter(lambda x: 'OMInterrupt' in x['_types'], p)
+    # Interrupts are taken from the innermost, last node with a type
+    # matching the device name.
+    matching = index.nodes_with_type_suffix(device, root=object_model)
+    if not matching:
+        return []
 
     rv = []
-    for an_interrupt in p:
+    for an_interrupt in index.nodes_of_type('OMInterrupt', root=matching[-1]):
         number = an_interrupt['numberAtReceiver']
         name = an_interrupt.get('name', '')
         if '@' in name:
             name = ''
-        int_data = Interrupt.make_interrupt(number, name)
+        int_data = context.make_interrupt(number, name)
         rv.append(int_data)
 
     return rv
 
 
-def find_register_fields(object_model: JSONType) -> t.List[RegisterField]:
+RegisterLayout = t.Tuple[
+    t.Tuple[str, int, int, str, t.Optional[str], t.Optional[int]], ...]
+
+
+def find_register_layout(object_model: JSONType) -> RegisterLayout:
     """
-    given a parsed device, return the register fields for the device
+    given a parsed device, return the raw description of its register fields
+
+    The layout is a tuple of plain values, so instances of a device with
+    identical register maps have equal, hashable layouts.
 
     :param object_model: a device parsed from the object model
-    :return: a list of register fields
+    :return: a (name, offset, width, group, addressBlock, resetValue)
+        tuple per field
     """
-    fields: t.List[RegisterField] = []
+    layout = []
     for mr in object_model['memoryRegions']:
         # get base address for each memory region
         if len(mr['addressSets']) != 1:
@@ -432,23 +964,45 @@ def find_register_fields(object_model: JSONType) -> t.List[RegisterField]:
             continue
 
         for aReg in mr['registerMap']['registerFields']:
-            r_group = aReg['description'].get('group')
+            description = aReg['description']
+            r_group = description.get('group')
             if not r_group:
                 continue
 
-            r_name = aReg['description']['name']
-            r_offset = aReg['bitRange']['base']
-            r_width = aReg['bitRange']['size']
-            r_addressBlock = aReg['description'].get('addressBlock')
-            r = RegisterField.make_register(r_name,
-                                            r_offset,
-                                            r_width,
-                                            r_group,
-                                            r_addressBlock)
+            bit_range = aReg['bitRange']
+            layout.append((description['name'],
+                           bit_range['base'],
+                           bit_range['size'],
+                           r_group,
+                           description.get('addressBlock'),
+                           description.get('resetValue')))
+
+    return tuple(layout)
+
+
+def make_register_fields(layout: RegisterLayout,
+                         context: GenerationContext) -> t.List[RegisterField]:
+    """
+    :param layout: a register layout, as returned by find_register_layout
+    :param context: the context in which to deduplicate register fields
+    :return: a list of register fields
+    """
+    return [context.make_register(*field) for field in layout]
 
-            fields.append(r)
 
-    return fields
+def find_register_fields(object_model: JSONType,
+                         context: t.Optional[GenerationContext] = None) \
+        -> t.List[RegisterField]:
+    """
+    given a parsed device, return the register fields for the device
+
+    :param object_model: a device parsed from the object model
+    :param context: the context in which to deduplicate register fields
+    :return: a list of register fields
+    """
+    if context is None:
+        context = GenerationContext()
+    return make_register_fields(find_register_layout(object_model), context)
 
 def find_address_blocks(object_model: JSONType) -> t.Sequence[AddressBlock]:
     """Find all address blocks in a design, returning the empty list if none exist."""
@@ -458,31 +1012,410 @@ def find_address_blocks(object_model: JSONType) -> t.Sequence[AddressBlock]:
             baseAddress=block['baseAddress'],
             range=block['range'],
             width=block['width'],
+            region=i,
         )
-        for region in object_model['memoryRegions']
+        for i, region in enumerate(object_model['memoryRegions'])
         for block in region.get('addressBlocks', [])
     ]
 
 def find_devices(object_model: JSONType,
-                 device: str) -> JSONType:
+                 device: str,
+                 index: t.Optional[ObjectModelIndex] = None) -> JSONType:
     """
 
     :param object_model: The full object model for the soc
     :param device: the name of the device in question
+    :param index: an index of object_model, if one has already been built
     :return: a list of the devices in the soc
     """
-    p = walk(object_model)
-    p = filter(lambda x: '_types' in x, p)
-    p = filter(lambda x: f'OM{device}' in x['_types'], p)
-    return list(enumerate(p))
+    if index is None:
+        index = ObjectModelIndex(object_model)
+    return list(enumerate(index.nodes_of_type(f'OM{device}')))
+
+
+def find_devices_batch(object_model: JSONType,
+                       devices: t.Sequence[str],
+                       index: t.Optional[ObjectModelIndex] = None) \
+        -> t.Dict[str, t.List[t.Tuple[int, JSONType]]]:
+    """
+    Find the instances of several devices with a single traversal of the
+    object model.
+
+    :param object_model: The full object model for the soc
+    :param devices: the names of the devices in question
+    :param index: an index of object_model, if one has already been built
+    :return: a mapping from device name to the enumerated list of its
+        instances, in the same order find_devices would return them
+    """
+    if index is None:
+        index = ObjectModelIndex(object_model)
+    return {device: find_devices(object_model, device, index)
+            for device in devices}
+
+
+def find_device_names(object_model: JSONType,
+                      index: t.Optional[ObjectModelIndex] = None) \
+        -> t.List[str]:
+    """
+    Find the names of every device of the object model which has memory
+    regions, i.e. the devices base headers can be generated for.
+
+    The name of a device is its most specific type, the first of its
+    _types, without the OM prefix.
+
+    :param object_model: The full object model for the soc
+    :param index: an index of object_model, if one has already been built
+    :return: the device names, in the order of their first instance
+    """
+    if index is None:
+        index = ObjectModelIndex(object_model)
+    return list(dict.fromkeys(
+        node['_types'][0][len('OM'):]
+        for node in index.nodes_of_type('OMDevice')
+        if node.get('memoryRegions') and node['_types'][0].startswith('OM')
+    ))
+
+# ###
+# Cache of the devices extracted from object models
+# ###
+
+DEFAULT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+
+def generator_version() -> str:
+    """
+    :return: an identifier of this generator, which changes whenever the
+        generator itself changes
+    """
+    return incremental.hash_file(__file__)
+
+
+def device_base_to_tuple(device: DeviceBase) -> tuple:
+    """Convert a DeviceBase to plain tuples, suitable for marshal."""
+    return (
+        device.name,
+        device.index,
+        device.base_interrupt,
+        device.base_address,
+        tuple(device.base_addresses),
+        tuple((i.number, i.name) for i in device.interrupts),
+        tuple((f.name, f.offset, f.width, f.regFieldGroup, f.addressBlock,
+               f.resetValue)
+              for f in device.register_fields),
+        tuple((b.name, b.baseAddress, b.range, b.width, b.region)
+              for b in device.address_blocks),
+    )
+
+
+def device_base_from_tuple(data: tuple) -> DeviceBase:
+    """Inverse of device_base_to_tuple."""
+    (name, index, base_interrupt, base_address, base_addresses, interrupts,
+     register_fields, address_blocks) = data
+    return DeviceBase(
+        name=name,
+        index=index,
+        base_interrupt=base_interrupt,
+        base_address=base_address,
+        base_addresses=[tuple(b) for b in base_addresses],
+        interrupts=[Interrupt(*i) for i in interrupts],
+        register_fields=[RegisterField(*f) for f in register_fields],
+        address_blocks=[AddressBlock(*b) for b in address_blocks],
+    )
+
+
+class DeviceCache:
+    """
+    On-disk cache of the devices extracted from an object model.
+
+    Entries are keyed by the content hash of the object model, the device
+    name, and the version of the generator, and hold the marshalled
+    DeviceBase list. The total size of the cache is bounded by evicting the
+    least recently used entries.
+
+    Failing to read or write the cache is never fatal; the object model is
+    parsed as if the cache were disabled.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int, object_model: str):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._key_prefix = '\0'.join((
+            incremental.hash_file(object_model),
+            generator_version(),
+            sys.version.split()[0],
+            str(marshal.version),
+        ))
+
+    def _entry_path(self, device: str) -> Path:
+        key = hashlib.sha256(f'{self._key_prefix}\0{device}'.encode()).hexdigest()
+        return self.cache_dir / f'{key}.marshal'
+
+    def load(self, device: str) -> t.Optional[t.List[DeviceBase]]:
+        """
+        :param device: the name of the device
+        :return: the cached instances of the device, or None on a miss
+        """
+        path = self._entry_path(device)
+        try:
+            data = marshal.loads(path.read_bytes())
+            devlist = [device_base_from_tuple(d) for d in data]
+            # Mark the entry as recently used.
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return devlist
+
+    def store(self, device: str, devlist: t.List[DeviceBase]) -> None:
+        """
+        Add the instances of a device to the cache, evicting the least
+        recently used entries if the cache grows over its maximum size.
+
+        :param device: the name of the device
+        :param devlist: the instances of the device
+        """
+        data = marshal.dumps(tuple(device_base_to_tuple(d) for d in devlist))
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=str(self.cache_dir),
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_name, str(self._entry_path(device)))
+            self._evict()
+        except OSError as e:
+            print(f"Could not write to the cache in {self.cache_dir}: {e}",
+                  file=sys.stderr)
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob('*.marshal'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+# ###
+# Library API
+# ###
+
+def make_device_bases(device: str,
+                      devices_om: t.List[t.Tuple[int, JSONType]],
+                      index: ObjectModelIndex,
+                      context: t.Optional[GenerationContext] = None) \
+        -> t.List[DeviceBase]:
+    """
+    Build the DeviceBase list for every instance of a device.
+
+    :param device: the name of the device
+    :param devices_om: the enumerated instances of the device, as returned
+        by find_devices
+    :param index: the index of the object model containing the devices
+    :param context: the context in which to deduplicate register fields and
+        interrupts. Should not be shared with other devices, as identically
+        named fields of two unrelated devices would then conflict.
+    :return: a list of devices
+    """
+    if context is None:
+        context = GenerationContext()
+
+    devlist: t.List[DeviceBase] = []
+
+    # Instances with the same register layout share one list of fields, so
+    # the register map of, e.g., a dozen identical UARTs is only parsed once.
+    # Instances sharing the register map objects themselves are matched by
+    # identity, without even extracting their layout. The objects are kept
+    # alive by devices_om, so their ids are not reused meanwhile.
+    fields_by_layout: t.Dict[RegisterLayout, t.List[RegisterField]] = {}
+    fields_by_maps: t.Dict[t.Tuple[int, ...], t.List[RegisterField]] = {}
+
+    for instance, dev_om in devices_om:
+        maps = tuple(id(region.get('registerMap'))
+                     for region in dev_om['memoryRegions'])
+        fields = fields_by_maps.get(maps)
+        if fields is None:
+            layout = find_register_layout(dev_om)
+            fields = fields_by_layout.get(layout)
+            if fields is None:
+                fields = make_register_fields(layout, context)
+                fields_by_layout[layout] = fields
+            fields_by_maps[maps] = fields
+        intlist = find_interrupts(dev_om, device, index, context)
+        base_int = min((i.number for i in intlist), default=None)
+        base_address = dev_om['memoryRegions'][0]['addressSets'][0]['base']
+        base_addresses = [
+            (region['description'], region['addressSets'][0]['base'])
+            for region in dev_om['memoryRegions']
+        ]
+        address_blocks = find_address_blocks(dev_om)
+
+        devlist.append(DeviceBase(name=device,
+                                  index=instance,
+                                  base_interrupt=base_int,
+                                  base_address=base_address,
+                                  base_addresses=base_addresses,
+                                  interrupts=intlist,
+                                  register_fields=fields,
+                                  address_blocks=address_blocks))
+
+    return devlist
+
+
+def find_device_bases(object_model: JSONType,
+                      devices: t.Sequence[str]) \
+        -> t.Dict[str, t.List[DeviceBase]]:
+    """
+    Extract the instances of several devices from an object model.
+
+    :param object_model: The full object model for the soc
+    :param devices: the names of the devices in question
+    :return: a mapping from device name to the list of its instances
+    """
+    index = ObjectModelIndex(object_model)
+    devices_om = find_devices_batch(object_model, devices, index)
+    return {device: make_device_bases(device, devices_om[device], index)
+            for device in devices}
+
+
+def base_header_path(vendor: str, device: str) -> str:
+    """
+    :return: the path of the base header of a device, relative to the bsp
+        directory
+    """
+    return f'bsp_{device}/{vendor}_{device}.h'
+
+
+def render_base_header(vendor: str, device: str,
+                       devlist: t.List[DeviceBase],
+                       report: t.Optional[t.TextIO] = None,
+                       out: t.Optional[t.TextIO] = None) -> t.Optional[str]:
+    """
+    Generate the base header of a device in a context of its own, reporting
+    any macro name collisions.
+
+    :param vendor: the vendor name
+    :param device: the device name
+    :param devlist: the instances of the device
+    :param report: where to report macro name collisions, defaulting to
+        the current sys.stderr
+    :param out: if given, the stream to write the header to
+    :return: the contents of the header, or None if written to out
+    """
+    context = GenerationContext()
+    header = generate_base_hdr(vendor, device, devlist, context, out)
+    context.report_name_collisions(report)
+    return header
+
+
+def generate_base_headers(object_model: t.Union[JSONType, str, Path],
+                          targets: t.Sequence[t.Tuple[str, str]]) \
+        -> t.Dict[str, str]:
+    """
+    Generate the base headers of several devices.
+
+    :param object_model: the parsed object model, or the path to it
+    :param targets: the (vendor, device) pairs to generate headers for
+    :return: a mapping from the path of each header, relative to the bsp
+        directory, to its contents
+    """
+    if isinstance(object_model, (str, Path)):
+        object_model = load_object_model(object_model)
+
+    devices = list(dict.fromkeys(device for _, device in targets))
+    devlists = find_device_bases(object_model, devices)
+    return {
+        base_header_path(vendor, device):
+            render_base_header(vendor, device, devlists[device])
+        for vendor, device in targets
+    }
+
+
+# ###
+# Parallel generation
+# ###
+
+# The object model and its index, shared with the worker processes of a
+# parallel run. Workers are forked once this is set, so they inherit the
+# parsed object model instead of receiving a pickled copy with every task.
+_SHARED_OBJECT_MODEL: t.Optional[t.Tuple[JSONType, ObjectModelIndex]] = None
+
+# (device, instances as plain tuples or None to extract them from the shared
+# object model, (vendor, path) of each header to write)
+DeviceTask = t.Tuple[str, t.Optional[t.List[tuple]], t.List[t.Tuple[str, Path]]]
+# (instances as plain tuples,
+#  {vendor: (name collision report, size of the header written)})
+DeviceResult = t.Tuple[t.List[tuple], t.Dict[str, t.Tuple[str, int]]]
+
+
+def generate_device_task(task: DeviceTask) -> DeviceResult:
+    """
+    Extract a device from the shared object model if needed, and write its
+    base headers.
+
+    Devices are passed in and out as plain tuples, which are cheaper to
+    pickle than DeviceBase objects. Headers are written by the task itself,
+    as they are generated, instead of being passed back.
+    """
+    device, devlist_data, headers = task
+    if devlist_data is None:
+        object_model, index = _SHARED_OBJECT_MODEL
+        with profiling.phase('extract_devices'):
+            devlist = make_device_bases(
+                device, find_devices(object_model, device, index), index)
+            devlist_data = [device_base_to_tuple(d) for d in devlist]
+    else:
+        devlist = [device_base_from_tuple(d) for d in devlist_data]
+
+    written = {}
+    with profiling.phase('write_headers'):
+        for vendor, path in headers:
+            report = io.StringIO()
+            path.parent.mkdir(exist_ok=True, parents=True)
+            with streaming.atomic_output(path) as fp:
+                render_base_header(vendor, device, devlist, report, fp)
+                size = fp.tell()
+            written[vendor] = (report.getvalue(), size)
+
+    return devlist_data, written
+
+
+def run_device_tasks(tasks: t.List[DeviceTask],
+                     jobs: int) -> t.List[DeviceResult]:
+    """
+    Run device tasks, in parallel over a pool of jobs forked processes if
+    jobs is more than one and the platform can fork.
+
+    :return: the results, in the same order as the tasks
+    """
+    if jobs > 1 and len(tasks) > 1 and \
+            'fork' in multiprocessing.get_all_start_methods():
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(tasks)),
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            return list(executor.map(generate_device_task, tasks))
+
+    return [generate_device_task(task) for task in tasks]
+
 
 ###
 # main
 ###
 
 
-def handle_args():
+def handle_args(argv: t.Optional[t.List[str]] = None):
     """
+    :param argv: the command line arguments, defaulting to sys.argv[1:]
     :return:
     """
     parser = argparse.ArgumentParser()
@@ -495,15 +1428,36 @@ def handle_args():
 
     parser.add_argument(
         "--vendor",
-        help="The vendor name",
-        required=True,
+        help="The vendor name. Either given once, applying to every device, "
+             "or once per --device.",
+        action="append",
+        default=[],
     )
 
     parser.add_argument(
         "-D",
         "--device",
-        help="The device name",
-        required=True,
+        help="The device name. May be repeated to generate the headers for "
+             "several devices from a single pass over the object model.",
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--manifest",
+        help="The path to a JSON file containing a list of "
+             "{\"vendor\": ..., \"device\": ...} objects to generate headers "
+             "for, in addition to any given with --vendor/--device",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--all-devices",
+        action="store_true",
+        default=False,
+        help="Generate the headers of every device of the object model with "
+             "memory regions, along with a soc_memory_map.h of the base "
+             "addresses of all of them. Requires a single --vendor.",
     )
 
     parser.add_argument(
@@ -514,6 +1468,49 @@ def handle_args():
         required=True,
     )
 
+    parser.add_argument(
+        "--stream-object-model",
+        action="store_true",
+        default=False,
+        help="Scan the object model incrementally, only keeping the requested "
+             "devices in memory. This is slower than loading the whole "
+             "object model, but peak memory follows the size of the "
+             "requested devices rather than the size of the file."
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help="The directory holding the cache of the devices extracted from "
+             "object models. The cache is only used when this is given, "
+             "e.g. with a directory of the build tree.",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        help="The maximum size of the cache in bytes. The least recently "
+             "used entries are evicted beyond it (default: %(default)s)",
+        type=int,
+        default=DEFAULT_CACHE_MAX_SIZE,
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Neither read from nor write to the cache, even if --cache-dir "
+             "is given"
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="The number of processes generating devices in parallel "
+             "(default: %(default)s)",
+        type=int,
+        default=1,
+    )
+
     parser.add_argument(
         "-x",
         "--overwrite-existing",
@@ -522,61 +1519,204 @@ def handle_args():
         help="overwrite existing files"
     )
 
-    return parser.parse_args()
+    incremental.add_arguments(parser)
+    profiling.add_arguments(parser)
 
+    args = parser.parse_args(argv)
+
+    vendors = args.vendor
+    devices = args.device
+    if len(vendors) > 1 and len(vendors) != len(devices):
+        parser.error("--vendor must be given either once or once per --device")
+    if devices and not vendors:
+        parser.error("--vendor is required with --device")
+    if args.all_devices and len(vendors) != 1:
+        parser.error("--vendor must be given once with --all-devices")
+    if len(vendors) == 1:
+        vendors = vendors * len(devices)
+    args.targets = list(zip(vendors, devices))
+
+    if args.manifest:
+        for entry in json.loads(args.manifest.read_text()):
+            args.targets.append((entry['vendor'], entry['device']))
+
+    if not args.targets and not args.all_devices:
+        parser.error("at least one --device, a --manifest or --all-devices "
+                     "is required")
+
+    return args
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    args = handle_args(argv)
+    with profiling.Profiler('generate_header', args.profile_report,
+                            args.profile_cprofile):
+        return run(args)
 
-def main() -> int:
-    args = handle_args()
-    vendor = args.vendor
-    device = args.device
-    overwrite_existing = args.overwrite_existing
-    object_model = json.load(open(args.object_model))
-    bsp_dir_path = args.bsp_dir
+
+def load_indexed_object_model(
+        f_name: str,
+        keep: t.Optional[t.Callable[[t.List[str]], bool]] = None) \
+        -> t.Tuple[JSONType, ObjectModelIndex]:
+    """
+    Load and index an object model, as one profiled phase each.
+
+    :param f_name: the path to the object model file
+    :param keep: as for load_object_model
+    :return: the object model and its index
+    """
+    with profiling.phase('load_object_model'):
+        object_model = load_object_model(f_name, keep)
+    profiling.count('object_model_bytes', os.path.getsize(f_name))
 
     # ###
     # parse OM to find base address of all devices
     # ###
 
-    devlist: t.List[DeviceBase] = []
+    with profiling.phase('index_object_model'):
+        index = ObjectModelIndex(object_model)
+    profiling.count('object_model_nodes', len(index))
+    return object_model, index
 
-    devices_om = find_devices(object_model, device)
-
-    for index, dev_om in devices_om:
-        fields = find_register_fields(dev_om)
-        intlist = find_interrupts(dev_om, device)
-        base_int = min((i.number for i in intlist), default=None)
-        base_address = dev_om['memoryRegions'][0]['addressSets'][0]['base']
-        base_addresses = [
-            (region['description'], region['addressSets'][0]['base'])
-            for region in dev_om['memoryRegions']
-        ]
-        address_blocks = find_address_blocks(dev_om)
 
-        devlist.append(DeviceBase(name=device,
-                                  index=index,
-                                  base_interrupt=base_int,
-                                  base_address=base_address,
-                                  base_addresses=base_addresses,
-                                  interrupts=intlist,
-                                  register_fields=fields,
-                                  address_blocks=address_blocks))
+def run(args: argparse.Namespace) -> int:
+    """
+    Generate the base headers requested on the command line.
 
-    base_hdr_path = bsp_dir_path / f'bsp_{device}'
-    base_hdr_path.mkdir(exist_ok=True, parents=True)
-    base_header_file_path = base_hdr_path / f'{vendor}_{device}.h'
+    :param args: the parsed command line arguments
+    :return: the exit status
+    """
+    global _SHARED_OBJECT_MODEL
 
-    if overwrite_existing or not base_header_file_path.exists():
-        base_header_file_path.write_text(
-            generate_base_hdr(vendor,
-                              device,
-                              devlist))
-    else:
-        print(f"{str(base_header_file_path)} exists, not creating.",
-              file=sys.stderr)
+    overwrite_existing = args.overwrite_existing
+    bsp_dir_path = args.bsp_dir
 
-    for k, v in NAME_COLLISION_DICT.items():
-        if v > 1:
-            print(f'Variable {k} repeated', file=sys.stderr)
+    options = incremental.hash_options(args)
+    version = incremental.source_version(__file__, streaming.__file__)
+    manifest_path = args.dependency_manifest
+    if args.incremental:
+        overwrite_existing = True
+        if manifest_path is None:
+            manifest_path = incremental.default_manifest_path(
+                bsp_dir_path, 'generate_header', options)
+        previous = incremental.DependencyManifest.load(manifest_path)
+        if previous is not None and \
+                previous.is_up_to_date('generate_header', version, options):
+            return 0
+
+    targets = list(args.targets)
+    shared = None
+    if args.all_devices:
+        # Every device has to be found in the object model, whether its
+        # instances are cached or not.
+        keep = None
+        if args.stream_object_model:
+            keep = lambda types: 'OMDevice' in types
+        shared = load_indexed_object_model(args.object_model, keep)
+        vendor = args.vendor[0]
+        targets.extend((vendor, device)
+                       for device in find_device_names(*shared))
+        targets = list(dict.fromkeys(targets))
+
+    devices = list(dict.fromkeys(device for _, device in targets))
+    profiling.count('devices', len(devices))
+
+    cache = None
+    if args.cache_dir is not None and not args.no_cache:
+        cache = DeviceCache(args.cache_dir, args.cache_max_size,
+                            args.object_model)
+
+    devlists: t.Dict[str, t.List[DeviceBase]] = {}
+    if cache is not None:
+        with profiling.phase('load_cache'):
+            for device in devices:
+                devlist = cache.load(device)
+                if devlist is not None:
+                    devlists[device] = devlist
+        profiling.count('cached_devices', len(devlists))
+
+    missing = [device for device in devices if device not in devlists]
+    if missing and shared is None:
+        keep = None
+        if args.stream_object_model:
+            om_types = {f'OM{device}' for device in missing}
+            keep = lambda types: not om_types.isdisjoint(types)
+        shared = load_indexed_object_model(args.object_model, keep)
+    if missing:
+        _SHARED_OBJECT_MODEL = shared
+
+    header_paths = {
+        (vendor, device): bsp_dir_path / base_header_path(vendor, device)
+        for vendor, device in targets
+    }
+    tasks: t.List[DeviceTask] = []
+    for device in devices:
+        devlist = devlists.get(device)
+        headers = [
+            (vendor, header_paths[(vendor, device)])
+            for vendor, target_device in targets
+            if target_device == device and (
+                overwrite_existing or
+                not header_paths[(vendor, device)].exists())
+        ]
+        if devlist is not None:
+            if not headers:
+                continue
+            devlist = [device_base_to_tuple(d) for d in devlist]
+        tasks.append((device, devlist, headers))
+
+    written = {}
+    with profiling.phase('generate_devices'):
+        results = run_device_tasks(tasks, args.jobs)
+    for (device, _, _), (devlist_data, device_written) in \
+            zip(tasks, results):
+        if device not in devlists and (cache is not None or args.all_devices):
+            devlists[device] = [device_base_from_tuple(d)
+                                for d in devlist_data]
+            if cache is not None:
+                with profiling.phase('store_cache'):
+                    cache.store(device, devlists[device])
+        profiling.count('instances', len(devlist_data))
+        profiling.count('register_fields',
+                        sum(len(d[6]) for d in devlist_data))
+        profiling.count('interrupts', sum(len(d[5]) for d in devlist_data))
+        for vendor, result in device_written.items():
+            written[(vendor, device)] = result
+    _SHARED_OBJECT_MODEL = None
+
+    for vendor, device in targets:
+        if (vendor, device) in written:
+            report, size = written[(vendor, device)]
+            sys.stderr.write(report)
+            profiling.count('files_written')
+            profiling.count('bytes_written', size)
+        else:
+            print(f"{str(header_paths[(vendor, device)])} exists, not creating.",
+                  file=sys.stderr)
+
+    outputs = list(header_paths.values())
+    if args.all_devices:
+        memory_map_path = bsp_dir_path / SOC_MEMORY_MAP_PATH
+        outputs.append(memory_map_path)
+        if overwrite_existing or not memory_map_path.exists():
+            with profiling.phase('write_memory_map'):
+                memory_map_path.parent.mkdir(exist_ok=True, parents=True)
+                with streaming.atomic_output(memory_map_path) as fp:
+                    generate_soc_memory_map(
+                        {device: devlists[device] for device in devices}, fp)
+                    size = fp.tell()
+            profiling.count('files_written')
+            profiling.count('bytes_written', size)
+        else:
+            print(f"{str(memory_map_path)} exists, not creating.",
+                  file=sys.stderr)
+
+    if manifest_path is not None:
+        incremental.DependencyManifest.record(
+            'generate_header', version, options,
+            inputs=[args.object_model],
+            outputs=outputs,
+        ).write(manifest_path)
 
     return 0
 
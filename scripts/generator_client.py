@@ -0,0 +1,106 @@
+#!/usr/bin/env python3.7
+
+"""
+Thin client for generator_server.py.
+
+    generator_client.py [--socket PATH] generate_header|generate_drivers [ARGS...]
+
+Runs the named generator with ARGS on the resident server listening on PATH,
+or on $API_GENERATOR_SOCKET if --socket is not given. When no server is
+reachable, the generator script is run directly instead, so the client can
+always be used in place of the scripts. Once a request has been sent, the
+generator may already be running on the server, so failing to get its
+response is an error rather than a reason to run the generator again.
+
+Only the standard library modules needed to talk to the server are
+imported, to keep the startup of the client itself short.
+"""
+
+import json
+import os
+import socket
+import sys
+
+SCRIPTS = ('generate_header', 'generate_drivers')
+
+
+def usage() -> None:
+    sys.exit(f"usage: {sys.argv[0]} [--socket PATH] "
+             f"{{{','.join(SCRIPTS)}}} [ARGS...]")
+
+
+def connect(socket_path: str) -> socket.socket:
+    """
+    :return: a connection to the server
+    :raise OSError: if the server cannot be reached
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(sock: socket.socket, script: str, argv: list) -> dict:
+    """
+    Send a request to the server and wait for its response.
+
+    :raise OSError: if the connection fails
+    :raise ValueError: if the response is missing or malformed, e.g.
+        because the server process handling the request died
+    """
+    message = {'script': script, 'argv': argv, 'cwd': os.getcwd()}
+    sock.sendall(json.dumps(message).encode() + b'\n')
+    with sock.makefile('rb') as fp:
+        line = fp.readline()
+    if not line:
+        raise ValueError("the server closed the connection without responding")
+    response = json.loads(line)
+    if not isinstance(response, dict) or \
+            not isinstance(response.get('stdout'), str) or \
+            not isinstance(response.get('stderr'), str) or \
+            not isinstance(response.get('returncode'), int):
+        raise ValueError(f"malformed response from the server: {line!r}")
+    return response
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    socket_path = os.environ.get('API_GENERATOR_SOCKET')
+    if args[:1] == ['--socket']:
+        if len(args) < 2:
+            usage()
+        socket_path = args[1]
+        args = args[2:]
+    if not args or args[0] not in SCRIPTS:
+        usage()
+    script, argv = args[0], args[1:]
+
+    sock = None
+    if socket_path:
+        try:
+            sock = connect(socket_path)
+        except OSError:
+            pass
+
+    if sock is not None:
+        with sock:
+            try:
+                response = request(sock, script, argv)
+            except (OSError, ValueError) as e:
+                print(f"{sys.argv[0]}: {script} failed on the server at "
+                      f"{socket_path}: {e}", file=sys.stderr)
+                return 1
+        sys.stdout.write(response['stdout'])
+        sys.stderr.write(response['stderr'])
+        return response['returncode']
+
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               f'{script}.py')
+    os.execv(sys.executable, [sys.executable, script_path] + argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
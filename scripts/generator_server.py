@@ -0,0 +1,161 @@
+#!/usr/bin/env python3.7
+
+"""
+Resident server for generate_header.py and generate_drivers.py.
+
+Starting a generator pays for the interpreter, the pipenv shim and the
+imports of every run, which is often more than the generation itself. This
+server imports the generators once and then runs each request in a forked
+child, so a build with many generations only pays the startup once.
+
+Requests are sent by generator_client.py over a local Unix socket, one JSON
+object per connection:
+
+    {"script": "generate_header", "argv": [...], "cwd": "..."}
+
+and answered with:
+
+    {"returncode": 0, "stdout": "...", "stderr": "..."}
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import traceback
+import typing as t
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+SCRIPTS = ('generate_header', 'generate_drivers')
+
+
+def import_generators() -> t.Dict[str, t.Any]:
+    """
+    Import every generator, remembering the ones which could not be
+    imported so that their requests can be answered with the error.
+
+    :return: a mapping from script name to module, or to the import error
+    """
+    modules: t.Dict[str, t.Any] = {}
+    for script in SCRIPTS:
+        try:
+            modules[script] = __import__(script)
+        except ImportError as e:
+            modules[script] = e
+    return modules
+
+
+def run_request(modules: t.Dict[str, t.Any], request: dict) -> dict:
+    """
+    Run the main() of a generator, capturing its output.
+
+    :param modules: the generators, as returned by import_generators
+    :param request: the decoded request
+    :return: the response to send back
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    returncode = 1
+
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            module = modules.get(request['script'])
+            if module is None:
+                raise Exception(f"Unknown script {request['script']}")
+            if isinstance(module, ImportError):
+                raise module
+            os.chdir(request['cwd'])
+            # Requests run in a forked child, so the server's own argv is
+            # left untouched.
+            sys.argv = [f"{request['script']}.py"] + request['argv']
+            returncode = module.main(request['argv'])
+        except SystemExit as e:
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                print(e.code, file=sys.stderr)
+        except Exception:
+            traceback.print_exc()
+
+    return {
+        'returncode': returncode,
+        'stdout': stdout.getvalue(),
+        'stderr': stderr.getvalue(),
+    }
+
+
+class GeneratorServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves each connection in a forked child, so that requests run in
+    parallel and cannot leak state into each other or into the server.
+    """
+
+    def __init__(self, socket_path: str, modules: t.Dict[str, t.Any]):
+        self.modules = modules
+        super().__init__(socket_path, GeneratorRequestHandler)
+
+
+class GeneratorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        response = run_request(self.server.modules, request)
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+def serve(socket_path: str) -> None:
+    """
+    Serve requests on a Unix socket until interrupted.
+
+    :param socket_path: the path of the socket to create
+    """
+    modules = import_generators()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # Let SIGTERM go through the same cleanup as ^C.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    with GeneratorServer(socket_path, modules) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
+def handle_args(argv: t.Optional[t.List[str]] = None):
+    """
+    :param argv: the command line arguments, defaulting to sys.argv[1:]
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-s",
+        "--socket",
+        help="The path of the Unix socket to listen on. generator_client.py "
+             "finds it through the API_GENERATOR_SOCKET environment variable.",
+        required=True,
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    args = handle_args(argv)
+    serve(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Incremental regeneration for the generator scripts.
+
+A generator run is described by a dependency manifest, a JSON file listing
+the content hash of every input file read and every output file written,
+along with a hash of the options affecting the output and the version of
+the generator:
+
+    {
+      "generator": "generate_header",
+      "generator_version": "<sha256>",
+      "options": "<sha256>",
+      "inputs": {"path/to/object_model.json": "<sha256>", ...},
+      "outputs": {"bsp/bsp_uart/sifive_uart.h": "<sha256>", ...}
+    }
+
+A later run with the same options can then be skipped when every input and
+output still has the hash it had, and build systems can read the inputs of
+the manifest to know exactly what a generated file depends on.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import typing as t
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+
+def hash_file(f_name: t.Union[str, Path]) -> str:
+    """
+    :return: the sha256 of the contents of a file
+    """
+    digest = hashlib.sha256()
+    with open(f_name, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file_if_exists(f_name: t.Union[str, Path]) -> t.Optional[str]:
+    """
+    :return: the sha256 of the contents of a file, or None if it cannot be
+        read, e.g. because it is a remote URI
+    """
+    try:
+        return hash_file(f_name)
+    except OSError:
+        return None
+
+
+def source_version(*f_names: t.Union[str, Path]) -> str:
+    """
+    :param f_names: the source files making up a generator
+    :return: an identifier of the generator, which changes whenever any of
+        its source files change
+    """
+    digest = hashlib.sha256()
+    for f_name in f_names:
+        digest.update(hash_file(f_name).encode())
+    return digest.hexdigest()
+
+
+# Options which only affect how a generator runs, not what it generates.
+RUN_OPTIONS = frozenset({
+    'cache_dir',
+    'cache_max_size',
+    'dependency_manifest',
+    'incremental',
+    'jobs',
+    'json5_cache',
+    'no_cache',
+    'overwrite_existing',
+    'profile_cprofile',
+    'profile_report',
+    'stream_object_model',
+})
+
+
+def hash_options(args: argparse.Namespace) -> str:
+    """
+    :param args: the parsed command line arguments of a generator
+    :return: a hash of the options affecting the generated files
+    """
+    options = {name: value for name, value in vars(args).items()
+               if name not in RUN_OPTIONS}
+    return hashlib.sha256(
+        json.dumps(options, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def default_manifest_path(out_dir: Path, generator: str, options: str) -> Path:
+    """
+    :return: where a run with the given options keeps its manifest when no
+        --dependency-manifest is given, so that runs generating different
+        files into the same directory do not share a manifest
+    """
+    return out_dir / f'.{generator}-{options[:16]}.deps.json'
+
+
+@dataclass
+class DependencyManifest:
+    generator: str
+    generator_version: str
+    options: str
+    inputs: t.Dict[str, t.Optional[str]]
+    outputs: t.Dict[str, str]
+
+    @classmethod
+    def load(cls, path: Path) -> t.Optional['DependencyManifest']:
+        """
+        :return: the manifest, or None if it is missing or unreadable
+        """
+        try:
+            return cls(**json.loads(path.read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    @classmethod
+    def record(cls, generator: str, generator_version: str, options: str,
+               inputs: t.Iterable[t.Union[str, Path]],
+               outputs: t.Iterable[t.Union[str, Path]]) -> 'DependencyManifest':
+        """
+        Describe a finished run, hashing its input and output files.
+        """
+        return cls(
+            generator=generator,
+            generator_version=generator_version,
+            options=options,
+            inputs={str(f): hash_file_if_exists(f) for f in inputs},
+            outputs={str(f): hash_file(f) for f in outputs},
+        )
+
+    def is_up_to_date(self, generator: str, generator_version: str,
+                      options: str) -> bool:
+        """
+        :return: True if a run of the given generator with the given options
+            would generate the same files as the run described by this
+            manifest, and these files are still unmodified
+        """
+        if (self.generator, self.generator_version, self.options) != \
+                (generator, generator_version, options):
+            return False
+        for f_name, digest in self.inputs.items():
+            if digest is None or hash_file_if_exists(f_name) != digest:
+                return False
+        for f_name, digest in self.outputs.items():
+            if hash_file_if_exists(f_name) != digest:
+                return False
+        return True
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = path.with_name(f'.{path.name}.tmp{os.getpid()}')
+        tmp_path.write_text(json.dumps(asdict(self), indent=2) + '\n')
+        os.replace(str(tmp_path), str(path))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the --incremental and --dependency-manifest options to a parser.
+    """
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Skip the run when its inputs, options and outputs are "
+             "unchanged since the run which wrote the dependency manifest, "
+             "and otherwise regenerate every file, overwriting stale ones",
+    )
+
+    parser.add_argument(
+        "--dependency-manifest",
+        help="The path to write the JSON manifest of the input and output "
+             "files of the run to. With --incremental, defaults to a hidden "
+             "file in the output directory.",
+        type=Path,
+    )
@@ -0,0 +1,217 @@
+"""
+Per-phase timing and memory instrumentation for the generator scripts.
+
+A script wraps its run in a Profiler, and marks the phases of its work with
+phase() and its counts with count():
+
+    with Profiler('generate_header', args.profile_report,
+                  args.profile_cprofile):
+        with phase('load_object_model'):
+            ...
+        count('devices', len(devices))
+
+phase() and count() are no-ops outside of an enabled Profiler, so library
+code can be instrumented without knowing whether anyone is measuring it.
+
+The report is a JSON object:
+
+    {
+      "script": "generate_header",
+      "argv": [...],
+      "python": "3.7.16",
+      "wall_time_s": ..., "cpu_time_s": ..., "memory_peak_bytes": ...,
+      "phases": [
+        {"name": "load_object_model", "calls": 1, "wall_time_s": ...,
+         "cpu_time_s": ..., "memory_peak_bytes": ...},
+        ...
+      ],
+      "counters": {"devices": 3, ...}
+    }
+
+Nested phases are named after their enclosing phases, e.g.
+"generate_devices/render_headers". Phases entered several times are
+aggregated. Memory is measured with tracemalloc, which only sees Python
+allocations and slows the run down noticeably. On Python versions without
+tracemalloc.reset_peak (before 3.9), the peak of a phase is the peak since
+profiling started. Only the current process is measured: work done in
+worker processes shows up in the phase which waits for it.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import typing as t
+
+
+# The profiler of the current run, if it is enabled.
+_ACTIVE: t.Optional['Profiler'] = None
+
+
+class _Frame:
+    __slots__ = ('name', 'wall_time', 'cpu_time', 'memory_peak')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wall_time = time.perf_counter()
+        self.cpu_time = time.process_time()
+        self.memory_peak = 0
+
+
+class Profiler:
+    """
+    Measures a run of a script, writing the report and the cProfile dump
+    when the run ends.
+
+    Disabled, doing nothing at all, if neither output path is given.
+    """
+
+    def __init__(self, script: str,
+                 report_path: t.Optional[str] = None,
+                 cprofile_path: t.Optional[str] = None):
+        self.script = script
+        self.report_path = report_path
+        self.cprofile_path = cprofile_path
+        self._phases: t.Dict[str, dict] = {}
+        self._counters: t.Dict[str, int] = {}
+        self._stack: t.List[_Frame] = []
+        self._cprofile: t.Optional[cProfile.Profile] = None
+        self._previous: t.Optional[Profiler] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.report_path or self.cprofile_path)
+
+    def __enter__(self) -> 'Profiler':
+        global _ACTIVE
+        if not self.enabled:
+            return self
+        self._previous, _ACTIVE = _ACTIVE, self
+        if self.report_path:
+            tracemalloc.start()
+        self._stack = [_Frame('')]
+        if self.cprofile_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _ACTIVE
+        if not self.enabled:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.cprofile_path)
+        if self.report_path:
+            report = dict(
+                script=self.script,
+                argv=sys.argv[1:],
+                python=platform.python_version(),
+                **self._finish(self._stack.pop()),
+                phases=[dict(name=name, **phase)
+                        for name, phase in self._phases.items()],
+                counters=self._counters,
+            )
+            tracemalloc.stop()
+            with open(self.report_path, 'w') as fp:
+                json.dump(report, fp, indent=2)
+                fp.write('\n')
+        _ACTIVE = self._previous
+
+    def _memory_peak(self) -> int:
+        return tracemalloc.get_traced_memory()[1] \
+            if tracemalloc.is_tracing() else 0
+
+    def _finish(self, frame: _Frame) -> dict:
+        memory_peak = max(frame.memory_peak, self._memory_peak())
+        if self._stack:
+            parent = self._stack[-1]
+            parent.memory_peak = max(parent.memory_peak, memory_peak)
+        return {
+            'wall_time_s': time.perf_counter() - frame.wall_time,
+            'cpu_time_s': time.process_time() - frame.cpu_time,
+            'memory_peak_bytes': memory_peak,
+        }
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[None]:
+        """
+        Measure the enclosed block as a phase of the run.
+        """
+        if not self._stack:
+            yield
+            return
+
+        parent = self._stack[-1]
+        if parent.name:
+            name = f'{parent.name}/{name}'
+        if hasattr(tracemalloc, 'reset_peak') and tracemalloc.is_tracing():
+            parent.memory_peak = max(parent.memory_peak, self._memory_peak())
+            tracemalloc.reset_peak()
+
+        frame = _Frame(name)
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            measured = self._finish(frame)
+            phase = self._phases.setdefault(name, {
+                'calls': 0,
+                'wall_time_s': 0.0,
+                'cpu_time_s': 0.0,
+                'memory_peak_bytes': 0,
+            })
+            phase['calls'] += 1
+            phase['wall_time_s'] += measured['wall_time_s']
+            phase['cpu_time_s'] += measured['cpu_time_s']
+            phase['memory_peak_bytes'] = max(phase['memory_peak_bytes'],
+                                             measured['memory_peak_bytes'])
+
+    def count(self, name: str, n: int = 1) -> None:
+        """
+        Add n to a counter of the report.
+        """
+        self._counters[name] = self._counters.get(name, 0) + n
+
+
+@contextlib.contextmanager
+def phase(name: str) -> t.Iterator[None]:
+    """
+    Measure the enclosed block as a phase of the current run, if profiled.
+    """
+    if _ACTIVE is None:
+        yield
+    else:
+        with _ACTIVE.phase(name):
+            yield
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Add n to a counter of the current run, if profiled.
+    """
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, n)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the --profile-report and --profile-cprofile options to a parser.
+    """
+    parser.add_argument(
+        "--profile-report",
+        help="Write the wall and CPU time and the peak memory of each phase "
+             "of the run, along with counters of the work done, as JSON to "
+             "this file. Tracing memory slows the run down.",
+    )
+
+    parser.add_argument(
+        "--profile-cprofile",
+        help="Write a cProfile dump of the run to this file, for use with "
+             "pstats or other profile viewers",
+    )
@@ -0,0 +1,90 @@
+"""
+Helpers for the generator scripts to write generated files as they are
+produced, rather than assembling each file as one string first.
+"""
+
+import contextlib
+import filecmp
+import os
+import string
+import tempfile
+import typing as t
+from pathlib import Path
+
+# A section of a template: either its text, the lines or blocks making up
+# its text, to be written separated by newlines, or a function writing its
+# text to a stream.
+Section = t.Union[str, t.Iterable[str], t.Callable[[t.TextIO], None]]
+
+
+def write_template(out: t.TextIO, template: string.Template,
+                   sections: t.Mapping[str, t.Union[Section, int]]) -> None:
+    """
+    Write a template, substituting its placeholders, to a stream.
+
+    This writes the same text as template.substitute(sections), except that
+    the iterable sections are written one piece at a time, as they are
+    generated, joined by newlines, and the sections given as functions write
+    themselves.
+
+    :param out: the stream to write to
+    :param template: the template
+    :param sections: the value of each placeholder
+    """
+    text = template.template
+    position = 0
+    for match in template.pattern.finditer(text):
+        out.write(text[position:match.start()])
+        position = match.end()
+
+        if match.group('escaped') is not None:
+            out.write(template.delimiter)
+            continue
+        name = match.group('named') or match.group('braced')
+        if name is None:
+            raise ValueError(f"Invalid placeholder in template at {match.start()}")
+
+        value = sections[name]
+        if isinstance(value, (str, int)):
+            out.write(str(value))
+        elif callable(value):
+            value(out)
+        else:
+            separator = ''
+            for piece in value:
+                out.write(separator)
+                out.write(piece)
+                separator = '\n'
+    out.write(text[position:])
+
+
+@contextlib.contextmanager
+def atomic_output(path: Path) -> t.Iterator[t.TextIO]:
+    """
+    Open a file to write a generated file to.
+
+    The file is written under a temporary name and only renamed to path once
+    it is complete, so a failed generation never leaves a truncated file
+    behind, which would then be mistaken for an existing one. If path
+    already has the same contents, it is left untouched, keeping its mtime
+    so that whatever depends on it is not rebuilt.
+
+    :param path: the path of the file
+    :return: the open file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent),
+                                    prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            yield fp
+        if path.exists() and filecmp.cmp(tmp_path, str(path), shallow=False):
+            os.unlink(tmp_path)
+            return
+        # mkstemp creates the file private to the user.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
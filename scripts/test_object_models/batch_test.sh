@@ -0,0 +1,27 @@
+#!/bin/sh
+
+# This is a basic command to test that generate header can produce the headers
+# for several devices from a single run.
+# Running this file shouldn't raise an exception, and a header should be
+# generated for every requested device.
+
+# Must be from from the directory 'scripts/test_object_models' of an api-generator-sifive repo
+if [ ! -x ../generate_header.py ]
+then
+    echo "This test must be from from the directory 'scripts/test_object_models' of an api-generator-sifive repo"
+    exit 2
+fi
+
+../generate_header.py --object-model no_interrupts.json --vendor sifive --device pio --device CLINT --bsp-dir batch --overwrite-existing --no-cache
+
+grep --quiet '#define PIO_COUNT 1' batch/bsp_pio/sifive_pio.h &&
+grep --quiet '#define CLINT_COUNT 1' batch/bsp_CLINT/sifive_CLINT.h
+
+if [ $? -eq 0 ]
+then
+    echo PASS
+    exit 0
+else
+    echo FAIL
+    exit 1
+fi
@@ -0,0 +1,24 @@
+#!/bin/sh
+
+# This is a basic command to test that streaming the object model generates
+# the same header as loading the whole object model.
+
+# Must be from from the directory 'scripts/test_object_models' of an api-generator-sifive repo
+if [ ! -x ../generate_header.py ]
+then
+    echo "This test must be from from the directory 'scripts/test_object_models' of an api-generator-sifive repo"
+    exit 2
+fi
+
+../generate_header.py --object-model large_address.json --vendor sifive --device pio --bsp-dir stream_object_model/loaded --overwrite-existing --no-cache &&
+../generate_header.py --object-model large_address.json --vendor sifive --device pio --bsp-dir stream_object_model/streamed --overwrite-existing --no-cache --stream-object-model &&
+cmp stream_object_model/loaded/bsp_pio/sifive_pio.h stream_object_model/streamed/bsp_pio/sifive_pio.h
+
+if [ $? -eq 0 ]
+then
+    echo PASS
+    exit 0
+else
+    echo FAIL
+    exit 1
+fi